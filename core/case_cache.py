@@ -0,0 +1,90 @@
+# case_cache.py
+# in-memory cache of the data of recently opened cases (parsed meshes, restart data)
+#
+# switching back to a recently opened case takes the data from the cache instead of reading the files again.
+# every entry belongs to a file on disk and is dropped as soon as the size or the modification time
+# of the file changes. When the total size of the entries is larger than the memory budget,
+# the least recently used entries are removed.
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from core.file_signature import file_signature
+
+# default memory budget of the cache
+CASE_CACHE_BUDGET = 2 * 1024**3
+
+_budget = CASE_CACHE_BUDGET
+# (kind, filename) -> (size, mtime) of the file and the cached data, least recently used first
+_entries = OrderedDict()
+# the meshes are looked up in the mesh reader thread
+_lock = threading.Lock()
+
+
+def set_case_cache_budget(nbytes):
+    global _budget
+    with _lock:
+        _budget = max(int(nbytes), 0)
+        _evict()
+
+
+# memory used by the cached data, only the large objects (arrays, dataframes, buffers, vtk data) are counted
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, "GetActualMemorySize"):
+        # vtk data arrays and data sets, in kibibytes
+        return value.GetActualMemorySize() * 1024
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+# remove the least recently used entries until the cache fits in the memory budget.
+# the size is computed again every time, the cached data can grow (e.g. markers that are read later on)
+def _evict():
+    sizes = {key: _nbytes(value) for key, (_, value) in _entries.items()}
+    total = sum(sizes.values())
+    while _entries and total > _budget:
+        key, _ = _entries.popitem(last=False)
+        total -= sizes[key]
+
+
+# the cached data of the file, None if the file is not in the cache or has changed
+def case_cache_get(kind, filename):
+    key = (kind, os.path.abspath(filename))
+    signature = file_signature(filename)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != signature:
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return entry[1]
+
+
+def case_cache_put(kind, filename, value):
+    signature = file_signature(filename)
+    if signature is None:
+        return
+    with _lock:
+        _entries[(kind, os.path.abspath(filename))] = (signature, value)
+        _entries.move_to_end((kind, os.path.abspath(filename)))
+        _evict()
+
+
+def case_cache_clear():
+    with _lock:
+        _entries.clear()
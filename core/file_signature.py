@@ -0,0 +1,13 @@
+# file_signature.py
+# size and modification time of a file, to find out cheaply if a file has changed
+
+import os
+
+
+def file_signature(filename):
+    """ (size, modification time in ns) of a file, None if the file does not exist """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
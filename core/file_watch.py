@@ -0,0 +1,162 @@
+# file_watch.py
+# notify when the solver has finished writing an output file (restart, history)
+#
+# on linux, inotify reports when a file that was opened for writing is closed (or moved into the directory),
+# so the gui reacts right after the solver has written the file. On other systems, or when inotify
+# is not available, the files are polled with os.stat.
+# a written file is only reported when its size and modification time are stable for a short time,
+# the header of the file still has to be checked by the reader.
+# files that the solver keeps open and appends to (the history) are reported on every write (inotify IN_MODIFY),
+# without waiting until they are stable: the reader only reads the complete lines.
+
+import os
+import sys
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+from pathlib import Path
+
+# Add parent directory to path to allow importing from sibling directories
+parent_dir = str(Path(__file__).parent.parent.absolute())
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from core.logger import log
+from core.file_signature import file_signature
+
+# inotify events: a file was written, a file opened for writing was closed, a file was moved into the directory
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+# struct inotify_event: watch descriptor, mask, cookie, length of the name (followed by the name)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+# time that the size and modification time of a written file have to be stable (seconds)
+FILE_WATCH_SETTLE = 0.05
+# interval of the polling fallback (seconds)
+FILE_WATCH_POLL_INTERVAL = 0.1
+
+
+# the inotify file descriptor watching the directory, None if inotify is not available
+def _inotify_watch(directory):
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch failed")
+    except (OSError, AttributeError) as e:
+        log("info", f"inotify is not available, polling the solver output files: {e}")
+        return None
+    return fd
+
+
+class FileWatch:
+    """ watch files in a directory and report the files that were written
+
+        usage:
+
+        watch = FileWatch(directory, ["history.csv", "restart.csv"], appended=["history.csv"])
+        written = await watch.wait(2.0)   # names of the files that were written, empty after the timeout
+        watch.close()
+
+        appended: the files that are appended to while they are open, these are reported without waiting
+        until they are stable
+    """
+
+    def __init__(self, directory, filenames, appended=()):
+        self._directory = str(directory)
+        self._filenames = set(filenames) | set(appended)
+        self._appended = set(appended)
+        # files that were written but are not (yet) reported
+        self._pending = set()
+        # signature of the files when they were last reported, for the polling
+        self._signatures = {name: self._signature(name) for name in self._filenames}
+        self._fd = _inotify_watch(self._directory)
+        self._event = asyncio.Event()
+        if self._fd is not None:
+            asyncio.get_event_loop().add_reader(self._fd, self._event.set)
+
+    def _signature(self, name):
+        return file_signature(os.path.join(self._directory, name))
+
+    # the watched files in the inotify events that are available
+    def _read_events(self):
+        self._event.clear()
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset + _INOTIFY_EVENT.size <= len(buffer):
+                _, mask, _, length = _INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += _INOTIFY_EVENT.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                # only the appended files are reported before they are closed
+                if name in self._filenames and (not mask & IN_MODIFY or name in self._appended):
+                    self._pending.add(name)
+
+    # the files that changed since they were last reported (polling)
+    def _poll(self):
+        for name in self._filenames:
+            if self._signature(name) != self._signatures[name]:
+                self._pending.add(name)
+
+    async def wait(self, timeout):
+        """ wait at most timeout seconds until watched files are written, returns the names of the written files """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if self._fd is not None:
+                self._read_events()
+            else:
+                self._poll()
+            # the appended files are reported right away
+            written = set()
+            for name in self._pending & self._appended:
+                signature = self._signature(name)
+                if signature is not None:
+                    written.add(name)
+                    self._signatures[name] = signature
+            self._pending -= self._appended
+            if self._pending:
+                # the file is complete when the size and modification time do not change anymore
+                before = {name: self._signature(name) for name in self._pending}
+                # removed files are not reported
+                self._pending -= {name for name, signature in before.items() if signature is None}
+                await asyncio.sleep(FILE_WATCH_SETTLE)
+                stable = {name for name, signature in before.items()
+                          if signature is not None and signature == self._signature(name)}
+                self._pending -= stable
+                for name in stable:
+                    self._signatures[name] = before[name]
+                written |= stable
+            if written:
+                return written
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return set()
+            if self._pending:
+                # still being written
+                continue
+            if self._fd is not None:
+                try:
+                    await asyncio.wait_for(self._event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(FILE_WATCH_POLL_INTERVAL, remaining))
+
+    def close(self):
+        if self._fd is not None:
+            asyncio.get_event_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
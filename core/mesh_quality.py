@@ -0,0 +1,207 @@
+# mesh_quality.py
+# statistics and quality report of a parsed .su2 mesh
+#
+# the quality measures are computed with numpy for all cells of an element type at once, directly on the
+# arrays returned by read_su2_mesh (no vtk objects needed), so the report can be made in a worker thread.
+# note that this module does not touch the trame state, so it can be used outside of the gui.
+
+import sys
+from pathlib import Path
+
+# Add parent directory to path to allow importing from sibling directories
+parent_dir = str(Path(__file__).parent.parent.absolute())
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import numpy as np
+
+from core.su2_mesh import SU2_NODES_PER_ELEMENT, su2_mesh_zones, su2_marker_cells
+
+# names of the su2 element types in the report
+SU2_ELEMENT_NAMES = {3: "line", 5: "triangle", 9: "quadrilateral", 10: "tetrahedron",
+                     12: "hexahedron", 13: "prism", 14: "pyramid"}
+
+# percentiles of the quality measures in the report
+REPORT_PERCENTILES = (1, 50, 99)
+
+# number of cells that are handled at once, this bounds the memory use for very large meshes
+REPORT_CHUNK_SIZE = 1 << 17
+
+# the faces of every element type, for the vtk node ordering. Seen from outside the element,
+# the nodes of a face are ordered counterclockwise, so the vtk reference cells have a positive volume.
+# A 2D element is its own face
+_FACES = {
+    5: [(0, 1, 2)],
+    9: [(0, 1, 2, 3)],
+    10: [(0, 1, 3), (1, 2, 3), (2, 0, 3), (0, 2, 1)],
+    12: [(0, 4, 7, 3), (1, 2, 6, 5), (0, 1, 5, 4), (3, 7, 6, 2), (0, 3, 2, 1), (4, 5, 6, 7)],
+    13: [(0, 2, 1), (3, 4, 5), (0, 1, 4, 3), (1, 2, 5, 4), (2, 0, 3, 5)],
+    14: [(0, 3, 2, 1), (0, 1, 4), (1, 2, 4), (2, 3, 4), (3, 0, 4)],
+}
+
+# the faces of every element type grouped by the number of nodes of the face,
+# and the edges of every element type (taken from the faces)
+_FACE_GROUPS = {}
+_EDGES = {3: np.array([(0, 1)])}
+for _type, _faces in _FACES.items():
+    _FACE_GROUPS[_type] = [np.array([f for f in _faces if len(f) == n]) for n in (3, 4)
+                           if any(len(f) == n for f in _faces)]
+    _EDGES[_type] = np.array(sorted({tuple(sorted((f[i], f[(i+1) % len(f)]))) for f in _faces for i in range(len(f))}))
+
+
+# quality measures of a block of cells of the same type, xyz is the (ncells, nnodes, 3) array of the nodes
+def _cell_quality(celltype, xyz, ndime):
+    # aspect ratio: longest edge / shortest edge
+    edges = _EDGES[celltype]
+    lengths = np.linalg.norm(xyz[:, edges[:, 1]] - xyz[:, edges[:, 0]], axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect_ratio = lengths.max(axis=1) / lengths.min(axis=1)
+    if celltype == 3:
+        return aspect_ratio, None, None
+
+    # equiangle skewness: largest deviation of the angles of the faces from the angle of the
+    # equilateral face (60 degrees for triangles, 90 degrees for quadrilaterals), 0 is perfect, 1 is degenerate
+    skewness = np.zeros(len(xyz))
+    # volume: sum over the faces of the (signed) tetrahedra between the cell center, a face edge and the face center
+    volume = np.zeros(len(xyz))
+    center = xyz.mean(axis=1)
+    for faces in _FACE_GROUPS[celltype]:
+        nodes = xyz[:, faces]
+        after = np.roll(nodes, -1, axis=2) - nodes
+        before = -np.roll(after, 1, axis=2)
+        length = np.sqrt(np.einsum('...i,...i', after, after))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos = np.einsum('...i,...i', before, after) / (np.roll(length, 1, axis=2) * length)
+        # the largest angle has the smallest cosine
+        equiangle = 60.0 if faces.shape[1] == 3 else 90.0
+        max_angle = np.degrees(np.arccos(np.clip(cos.min(axis=2), -1.0, 1.0)))
+        min_angle = np.degrees(np.arccos(np.clip(cos.max(axis=2), -1.0, 1.0)))
+        skew = np.maximum((max_angle - equiangle) / (180.0 - equiangle), (equiangle - min_angle) / equiangle)
+        # faces with coinciding nodes are fully skewed
+        skewness = np.maximum(skewness, np.nan_to_num(skew, nan=1.0).max(axis=1))
+
+        if ndime == 2:
+            # signed area in the x-y plane, positive for counterclockwise elements
+            x, y = nodes[..., 0], nodes[..., 1]
+            volume += 0.5 * np.sum(x * np.roll(y, -1, axis=2) - np.roll(x, -1, axis=2) * y, axis=(1, 2))
+        elif celltype == 10:
+            # tetrahedra directly
+            edges = xyz[:, 1:] - xyz[:, :1]
+            volume = np.einsum('ij,ij->i', edges[:, 0], np.cross(edges[:, 1], edges[:, 2])) / 6.0
+        else:
+            a = nodes - center[:, None, None, :]
+            c = nodes.mean(axis=2, keepdims=True) - center[:, None, None, :]
+            volume += np.einsum('...i,...i', a, np.cross(after, c)).sum(axis=(1, 2)) / 6.0
+    return aspect_ratio, skewness, volume
+
+
+# min, max and percentiles of a quality measure
+def _stats(values):
+    if len(values) == 0:
+        return None
+    stats = {"min": float(values.min())}
+    for p, value in zip(REPORT_PERCENTILES, np.percentile(values, REPORT_PERCENTILES, method="nearest")):
+        stats[f"p{p}"] = float(value)
+    stats["max"] = float(values.max())
+    return stats
+
+
+def su2_mesh_report(mesh, progress=None):
+    """ statistics and quality report of a mesh returned by read_su2_mesh
+
+        returns a json serializable dict with:
+        ndime, zones, points, cells: the size of the mesh
+        cell_types: number of cells of every element type
+        aspect_ratio, skewness, volume: min, max and percentiles over all cells (volume is the area in 2D)
+        negative_volume: number of cells with a negative volume (inverted cells)
+        invalid_cells, invalid_marker_cells: number of volume and marker elements with a point index
+        outside of the points of the zone, these cells are left out of the quality measures
+
+        progress(what, count, total) is called after every block of cells, it can stop the report by raising an exception
+    """
+    zones = su2_mesh_zones(mesh)
+    ndime = zones[0]["ndime"]
+    ncells = sum(len(zone["cell_types"]) for zone in zones)
+    counts = {}
+    aspect_ratio, skewness, volume = [], [], []
+    invalid_cells = 0
+    invalid_marker_cells = 0
+    invalid_markers = []
+    ndone = 0
+
+    for zone in zones:
+        points = zone["points"]
+        npoin = len(points)
+        cell_types = np.asarray(zone["cell_types"])
+        offsets = np.asarray(zone["offsets"])
+        connectivity = np.asarray(zone["connectivity"])
+
+        for celltype, name in SU2_ELEMENT_NAMES.items():
+            cells = np.flatnonzero(cell_types == celltype)
+            if len(cells) == 0:
+                continue
+            counts[name] = counts.get(name, 0) + len(cells)
+            nnodes = SU2_NODES_PER_ELEMENT[celltype]
+            for start in range(0, len(cells), REPORT_CHUNK_SIZE):
+                block = cells[start:start + REPORT_CHUNK_SIZE]
+                nodes = connectivity[offsets[block][:, None] + np.arange(nnodes)]
+                valid = np.all((nodes >= 0) & (nodes < npoin), axis=1)
+                invalid_cells += int(np.count_nonzero(~valid))
+                ar, skew, vol = _cell_quality(celltype, points[nodes[valid]].astype(np.float64), zone["ndime"])
+                aspect_ratio.append(ar.astype(np.float32))
+                if skew is not None:
+                    skewness.append(skew.astype(np.float32))
+                    volume.append(vol)
+                ndone += len(block)
+                if progress is not None:
+                    progress("report", ndone, ncells)
+
+        # the marker elements only have to refer to existing points
+        for marker in zone["markers"]:
+            cells = su2_marker_cells(zone["source"], marker)
+            nodes = np.asarray(cells["connectivity"])
+            invalid = (nodes < 0) | (nodes >= npoin)
+            if invalid.any():
+                invalid_marker_cells += int(np.count_nonzero(np.add.reduceat(invalid, cells["offsets"][:-1])))
+                invalid_markers.append(marker["tag"])
+
+    def concatenate(arrays):
+        return np.concatenate(arrays) if arrays else np.zeros(0)
+
+    volume = concatenate(volume)
+    return {"ndime": ndime,
+            "zones": len(zones),
+            "points": sum(len(zone["points"]) for zone in zones),
+            "cells": ncells,
+            "cell_types": counts,
+            "aspect_ratio": _stats(concatenate(aspect_ratio)),
+            "skewness": _stats(concatenate(skewness)),
+            "volume": _stats(volume),
+            "negative_volume": int(np.count_nonzero(volume < 0.0)),
+            "invalid_cells": invalid_cells,
+            "invalid_marker_cells": invalid_marker_cells,
+            "invalid_markers": invalid_markers}
+
+
+# the report as text, for the mesh info in the gui
+def format_su2_mesh_report(report):
+    volume = "volume" if report["ndime"] == 3 else "area"
+    lines = [f"Mesh dimensions: {report['ndime']}D",
+             f"Number of zones: {report['zones']}",
+             f"Number of points: {report['points']}",
+             f"Number of cells: {report['cells']}"]
+    for name, count in report["cell_types"].items():
+        lines.append(f"  {name}: {count}")
+
+    columns = ["min"] + [f"p{p}" for p in REPORT_PERCENTILES] + ["max"]
+    lines.append("quality (" + ", ".join(columns) + "):")
+    for key, label in (("aspect_ratio", "aspect ratio"), ("skewness", "skewness"), ("volume", volume)):
+        if report[key] is not None:
+            lines.append(f"  {label}: " + ", ".join(f"{report[key][c]:.4g}" for c in columns))
+
+    lines.append(f"Cells with negative {volume}: {report['negative_volume']}")
+    lines.append(f"Cells with invalid point indices: {report['invalid_cells']}")
+    lines.append(f"Marker elements with invalid point indices: {report['invalid_marker_cells']}")
+    if report["invalid_markers"]:
+        lines.append("  in markers: " + ", ".join(report["invalid_markers"]))
+    return "\n".join(lines)
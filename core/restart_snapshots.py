@@ -0,0 +1,102 @@
+# restart_snapshots.py
+# ring buffer with the last restart solutions of a run, for chosen fields
+#
+# every field has one float32 array with a slot per snapshot, allocated when the field is first stored.
+# the vtk arrays of the slots wrap the slots without copying (same layout as the point data of the grid),
+# so showing a snapshot only replaces the arrays of the grid. When the buffer is full, the slot of the oldest
+# snapshot is used for the new snapshot.
+
+import sys
+from collections import deque
+from pathlib import Path
+
+# Add parent directory to path to allow importing from sibling directories
+parent_dir = str(Path(__file__).parent.parent.absolute())
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import numpy as np
+from vtkmodules.util import numpy_support
+
+from core.logger import log
+
+# default memory budget of the snapshots of all fields
+RESTART_SNAPSHOT_BUDGET = 512 * 1024**2
+# default number of snapshots
+RESTART_SNAPSHOT_COUNT = 20
+
+_budget = RESTART_SNAPSHOT_BUDGET
+# number of slots, the slot buffer and the vtk arrays of the slots of every field,
+# and the snapshots (slot, iteration, names of the stored fields) from old to new
+_snapshots = {"size": RESTART_SNAPSHOT_COUNT, "buffers": {}, "views": {}, "slots": deque()}
+
+
+def set_restart_snapshot_budget(nbytes):
+    global _budget
+    _budget = max(int(nbytes), 0)
+
+
+# remove all snapshots, size is the new number of snapshots
+def clear_restart_snapshots(size=None):
+    if size is not None:
+        _snapshots["size"] = max(int(size), 1)
+    _snapshots["buffers"] = {}
+    _snapshots["views"] = {}
+    _snapshots["slots"] = deque()
+
+
+# the slot buffer of a field, allocated the first time the field is stored. None if it does not fit in the budget
+def _field_buffer(name, values):
+    buffer = _snapshots["buffers"].get(name)
+    if buffer is not None and buffer.shape[1:] == values.shape:
+        return buffer
+    nbytes = _snapshots["size"] * values.size * 4
+    used = sum(b.nbytes for key, b in _snapshots["buffers"].items() if key != name)
+    if used + nbytes > _budget:
+        log("warn", f"no memory left for the snapshots of {name} ({nbytes / 1024**2:.0f} MB)")
+        return None
+    buffer = np.empty((_snapshots["size"],) + values.shape, dtype=np.float32)
+    views = []
+    for slot in buffer:
+        ArrayObject = numpy_support.numpy_to_vtk(slot, deep=False)
+        ArrayObject.SetName(name)
+        views.append(ArrayObject)
+    _snapshots["buffers"][name] = buffer
+    _snapshots["views"][name] = views
+    # the older snapshots of the field had another size
+    for snapshot in _snapshots["slots"]:
+        snapshot["fields"].discard(name)
+    return buffer
+
+
+def add_restart_snapshot(iteration, arrays):
+    """ store the vtk point data arrays as a new snapshot, the oldest snapshot is removed when the buffer is full """
+    slots = _snapshots["slots"]
+    if len(slots) < _snapshots["size"]:
+        slot = len(slots)
+    else:
+        slot = slots.popleft()["slot"]
+    fields = set()
+    for ArrayObject in arrays:
+        name = ArrayObject.GetName()
+        values = numpy_support.vtk_to_numpy(ArrayObject)
+        buffer = _field_buffer(name, values)
+        if buffer is not None:
+            buffer[slot] = values
+            fields.add(name)
+    slots.append({"slot": slot, "iteration": iteration, "fields": fields})
+
+
+# the number of snapshots that are kept
+def restart_snapshot_size():
+    return _snapshots["size"]
+
+
+def restart_snapshot_iterations():
+    return [snapshot["iteration"] for snapshot in _snapshots["slots"]]
+
+
+def restart_snapshot_arrays(index):
+    """ the vtk arrays of snapshot index (0 is the oldest), these wrap the snapshot buffer """
+    snapshot = _snapshots["slots"][index]
+    return [_snapshots["views"][name][snapshot["slot"]] for name in sorted(snapshot["fields"])]
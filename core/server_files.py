@@ -0,0 +1,31 @@
+# server_files.py
+# files on the server that are passed to the loaders through the trame state (mesh, restart of a case)
+#
+# the state can be written by the client, so it never contains a path on the server.
+# the path is kept in a registry on the server and the state entry only has a random id,
+# a loader only opens the files that the server registered itself.
+
+import os
+import uuid
+
+# id -> absolute path of the file
+_server_files = {}
+
+
+def server_file_info(filename, type="text/plain"):
+    """ the state entry for a file on the server: the metadata and the id of the file, not its path """
+    file_id = uuid.uuid4().hex
+    _server_files[file_id] = os.path.abspath(filename)
+    return {
+        "name": os.path.basename(filename),
+        "size": os.stat(filename).st_size,
+        "server_file": file_id,
+        "type": type,
+    }
+
+
+def server_file_path(info):
+    """ the path of a state entry made by server_file_info, None for an uploaded file or an unknown id """
+    if not isinstance(info, dict):
+        return None
+    return _server_files.get(info.get("server_file"))
@@ -17,16 +17,23 @@ if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
 from ui.uicard import ui_card, ui_subcard, server
-from trame.widgets import vuetify
+from trame.widgets import vuetify, html
 from core.su2_json import *
-from core.su2_io import save_su2mesh, save_json_cfg_file
+from core.su2_io import save_su2mesh, save_json_cfg_file, save_vtm, CASE_VTM_FILENAME
+from core.case_cache import case_cache_get, case_cache_put
+from core.file_watch import FileWatch
+from core.file_signature import file_signature
+from core.server_files import server_file_path
+from core.su2_history import SU2History, decimate_min_max, residual_decay_rate, iteration_rate, CONV_FIELD_COLUMNS
+from core.restart_snapshots import add_restart_snapshot, clear_restart_snapshots, restart_snapshot_iterations, restart_snapshot_arrays, restart_snapshot_size, RESTART_SNAPSHOT_COUNT
 
 # check if a file is opened by another process
 #import psutil
 
+import numpy as np
 import pandas as pd
 from base64 import b64decode
-import subprocess, io, struct, os
+import subprocess, io, struct, os, re
 
 # real-time update, asynchronous io
 import asyncio
@@ -36,6 +43,7 @@ from trame.app.file_upload import ClientFile
 
 import vtk
 from vtkmodules.vtkCommonDataModel import vtkDataObject
+from vtkmodules.util import numpy_support
 
 # import the grid from the mesh module
 from ui.mesh import *
@@ -90,10 +98,16 @@ def set_json_solver():
 # matplotlib
 state.active_figure="mpl_plot_history"
 state.graph_update=True
-@state.change("active_figure", "figure_size", "countdown","monitorLinesVisibility")
+@state.change("active_figure", "figure_size", "countdown","monitorLinesVisibility", "history_plot_range")
 def update_chart(active_figure, **kwargs):
+    # the figure is only made and sent to the client again when the history or the plot settings changed,
+    # the countdown changes on every refresh during a run, also when the solver did not write new lines
+    key = history_figure_key(active_figure)
+    if key == _history_figure["key"]:
+        return
     log("info", "updating figure 1")
     ctrl.update_figure(globals()[active_figure]())
+    _history_figure["key"] = key
     #ctrl.update_figure2(globals()[active_figure]())
 
 #matplotlib
@@ -135,30 +149,57 @@ def dialog_card():
         )
 
 
+        # zoom into a range of the iterations, the lines are shown with full resolution when the range is small enough
+        vuetify.VRangeSlider(
+                              v_model=("history_plot_range", [0, 100]),
+                              label="Iterations (%)",
+                              min=0,
+                              max=100,
+                              step=0.1,
+                              thumb_label=True,
+                              hide_details=True,
+                              dense=True,
+                              classes="mt-4",
+        )
+
         # close dialog window button
         # right-align the button
         with vuetify.VCol(classes="text-right"):
           vuetify.VBtn("Close", classes="mt-5",click=update_dialog)
 
 
-# real-time update every xx seconds
+# real-time update when the solver has written the history or restart file, and at least every 2 seconds
+# the updates are at most every SOLVER_REFRESH_INTERVAL seconds, the solver can write the history every iteration
+SOLVER_REFRESH_INTERVAL = 0.5
+
 @asynchronous.task
 async def start_countdown(result):
     global proc_SU2
 
+    # the solver keeps the history file open and appends a line every iteration
+    watch = FileWatch(BASE / "user" / state.case_name, [state.restart_filename], appended=[state.history_filename])
+    # the snapshots of an earlier run are removed
+    update_restart_snapshots(state.restart_snapshots, state.restart_snapshots_max)
+    try:
+      await watch_solver_output(watch)
+    finally:
+      watch.close()
+
+async def watch_solver_output(watch):
     while state.keep_updating:
         with state:
-            await asyncio.sleep(2.0)
+            written = await watch.wait(2.0)
             log("debug", f"iteration =  = {state.global_iter, type(state.global_iter)}")
             wrt_freq = state.jsonData['OUTPUT_WRT_FREQ'][1]
             log("debug", f"wrt_freq =  = {wrt_freq, type(wrt_freq)}")
             log("info", f"iteration save =  = {state.global_iter % wrt_freq}")
             log("debug", f"keep updating =  = {state.keep_updating}")
-            # update the history from file
-            readHistory(BASE / "user" / state.case_name / state.history_filename)
+            # update the history from file, also after the timeout when the file was not reported
+            if state.history_filename in written or not written:
+              readHistory(BASE / "user" / state.case_name / state.history_filename)
             # update the restart from file, do not reset the active scalar value
-            # do not update when we are about to write to the file
-            readRestart(BASE / "user" / state.case_name / state.restart_filename, False)
+            if state.restart_filename in written:
+              readRestart(BASE / "user" / state.case_name / state.restart_filename, False, live=True)
 
             # we flip-flop the true-false state to keep triggering the state and read the history file
             state.countdown = not state.countdown
@@ -171,7 +212,15 @@ async def start_countdown(result):
               # set the running state to false
               state.solver_running = False
               state.solver_icon="mdi-play-circle"
+              # the last lines of the history
+              readHistory(BASE / "user" / state.case_name / state.history_filename)
+              readRestart(BASE / "user" / state.case_name / state.restart_filename, False)
+              # save the mesh with the final solution, reopening the case reads this file in one go.
+              # only when asked for, writing a large mesh takes a while
+              if state.case_vtm_autosave:
+                save_vtm(root, CASE_VTM_FILENAME)
             update_su2_logs()
+        await asyncio.sleep(SOLVER_REFRESH_INTERVAL)
 
 
 ###############################################################
@@ -208,6 +257,40 @@ def solver_card():
         with vuetify.VBtn("Solve",click=su2_play):
             vuetify.VIcon("{{solver_icon}}",color="purple")
 
+        # save the mesh and the solution as case.vtm when the run has finished
+        vuetify.VCheckbox(
+            v_model=("case_vtm_autosave", False),
+            label="Save case after the run",
+            dense=True,
+            hide_details=True,
+        )
+
+        # keep the last restart solutions of the run (shown and pinned fields), to go back in time with the slider
+        with vuetify.VRow(classes="pt-2"):
+          with vuetify.VCol(cols="7"):
+            vuetify.VCheckbox(
+                v_model=("restart_snapshots", False),
+                label="Keep snapshots",
+                dense=True,
+                hide_details=True,
+            )
+          with vuetify.VCol(cols="5"):
+            vuetify.VTextField(
+                v_model=("restart_snapshots_max", RESTART_SNAPSHOT_COUNT),
+                label="Snapshots",
+                disabled=("!restart_snapshots",),
+            )
+        vuetify.VSlider(
+            v_if="restart_snapshots && restart_snapshot_iterations.length > 1",
+            v_model=("restart_snapshot_idx", 0),
+            min=0,
+            max=("restart_snapshot_iterations.length - 1",),
+            step=1,
+            label=("`iteration ${restart_snapshot_iterations[restart_snapshot_idx]}`",),
+            hide_details=True,
+            dense=True,
+        )
+
 ########################################################################################
 # Checks/Corrects some json entries before starting the Solver
 ########################################################################################
@@ -249,8 +332,34 @@ def update_material(convergence_val, **kwargs):
       state.jsonData['CONV_RESIDUAL_MINVAL'] = int(state.convergence_val)
     except ValueError:
       log("error", "Invalid value for CONV_RESIDUAL_MINVAL in solver")
+    update_convergence_estimate()
 
 
+# the number of snapshots in the "Snapshots" field, None when it is not a number
+def restart_snapshot_count(restart_snapshots_max):
+    try:
+      return int(restart_snapshots_max)
+    except (TypeError, ValueError):
+      log("error", "Invalid number of snapshots")
+      return None
+
+@state.change("restart_snapshots", "restart_snapshots_max")
+def update_restart_snapshots(restart_snapshots, restart_snapshots_max, **kwargs):
+    size = restart_snapshot_count(restart_snapshots_max)
+    if size is None:
+      return
+    clear_restart_snapshots(size)
+    state.restart_snapshot_iterations = []
+    state.restart_snapshot_idx = 0
+
+# show the snapshot of the slider, also the newest one: it replaces the arrays of an older snapshot that was shown
+@state.change("restart_snapshot_idx")
+def update_restart_snapshot_idx(restart_snapshot_idx, **kwargs):
+    if not 0 <= restart_snapshot_idx < len(state.restart_snapshot_iterations):
+      return
+    show_restart_snapshot(restart_snapshot_idx)
+    ctrl.view_update()
+
 # start SU2 solver
 def su2_play():
     global proc_SU2
@@ -434,6 +543,7 @@ def update_solver_dialog_card_convergence():
          for i in range(len(state.convergence_fields_visibility)):
             if (state.convergence_fields_visibility[i]==True):
                state.jsonData['CONV_FIELD'].append(state.convergence_fields[i])
+         update_convergence_estimate()
 
 
 
@@ -453,107 +563,279 @@ def update_dialog():
 ###############################################################################
 # Read the history file
 # set the names and visibility
+# the history file is read incrementally (see core/su2_history.py), only the lines that were added are parsed
+# estimate: the history and the settings of the last convergence estimate
+_history = {"reader": None, "estimate": None}
+
+# the iterations and the values of the monitored (rms and Res) columns of the history file
+def history_lines():
+    reader = _history["reader"]
+    if reader is None:
+        return np.zeros(0), []
+    columns = reader.columns()
+    ylist = [columns[i] for i, name in enumerate(reader.names) if re.search('rms|Res', name)]
+    return np.arange(reader.count), ylist
+
 def readHistory(filename):
     log("debug", f"read_history, filename= = {filename}")
-    skipNrRows=[]
-    # read the history file
-    dataframe = pd.read_csv(filename,skiprows=skipNrRows)
-    # get rid of quotation marks in the column names
-    dataframe.columns = dataframe.columns.str.replace('"','')
-    # get rid of spaces in the column names
-    dataframe.columns = dataframe.columns.str.replace(' ','')
+    reader = _history["reader"]
+    if reader is None or reader.filename != str(filename):
+        reader = _history["reader"] = SU2History(filename)
+    nnew = reader.update()
+    log("debug", f"read_history, new lines = {nnew}")
 
     # limit the columns to the ones containing the strings rms and Res
-    dfrms = dataframe.filter(regex='rms|Res')
+    names = [name for name in reader.names if re.search('rms|Res', name)]
 
     # only set the initial state the first time
-    if state.monitorLinesNames==[]:
-       state.monitorLinesNames = list(dfrms)
+    if state.monitorLinesNames==[] or len(state.monitorLinesNames) != len(names):
+       state.monitorLinesNames = names
        state.monitorLinesRange = list(range(0,len(state.monitorLinesNames)))
-       state.monitorLinesVisibility = [True for i in dfrms]
+       state.monitorLinesVisibility = [True for i in names]
        state.dirty('monitorLinesNames')
        state.dirty('monitorLinesVisibility')
        state.dirty('monitorLinesRange')
 
-    state.x = [i for i in range(len(dfrms.index))]
     # number of global iterations, assuming we start from 0 and every line is an iteration.
     # actually, we should look at Inner_Iter
-    state.global_iter = len(dfrms.index)
-    #log("info", f"x =  = {state.x}")
-    state.ylist=[]
-    for c in range(len(dfrms.columns)):
-        state.ylist.append(dfrms.iloc[:,c].tolist())
+    state.global_iter = reader.count
 
+    update_convergence_estimate()
     dialog_card()
-    return [state.x,state.ylist]
+    return history_lines()
+
+
+###############################################################################
+# convergence estimate, shown next to the history plot:
+# the decay rate of the residuals in CONV_FIELD (fitted to the last lines of the history), the iterations per second,
+# and the iteration and wall clock time at which the residuals reach CONV_RESIDUAL_MINVAL.
+# the estimate only uses the last lines of the history and is only computed again when the history or the settings changed
+state.convergence_estimates = []
+state.convergence_iteration_rate = "-"
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+# the projected iteration and time of a residual, remaining is the number of iterations until it reaches the target
+def convergence_row(field, slope, remaining, last_iter, rate):
+    row = {"field": field, "rate": "-", "iteration": "-", "time": "-"}
+    if slope is not None:
+      row["rate"] = f"{slope:.2e}"
+    if remaining is None:
+      if slope is not None:
+        row["iteration"] = "not converging"
+      return row
+    row["iteration"] = str(int(np.ceil(round(last_iter + remaining, 6))))
+    if rate:
+      row["time"] = format_duration(remaining / rate)
+    return row
+
+def update_convergence_estimate():
+    reader = _history["reader"]
+    fields = state.jsonData.get('CONV_FIELD', []) if state.jsonData else []
+    if isinstance(fields, str):
+      fields = [fields]
+    target = state.jsonData.get('CONV_RESIDUAL_MINVAL', state.convergence_val) if state.jsonData else state.convergence_val
+    key = (id(reader), reader.version if reader else None, repr(fields), repr(target))
+    if key == _history["estimate"]:
+      return
+    _history["estimate"] = key
+
+    estimates, rate = [], None
+    try:
+      target = float(target)
+    except (TypeError, ValueError):
+      target = None
+    if reader is not None and reader.count > 1 and target is not None:
+      # the history is not always written every iteration
+      iterations = reader.column("Inner_Iter") if "Inner_Iter" in reader.names else np.arange(reader.count)
+      if "Time(sec)" in reader.names:
+        rate = iteration_rate(iterations, reader.column("Time(sec)"))
+      # the run has converged when all fields reached the target
+      remaining_all = []
+      for field in fields:
+        name = CONV_FIELD_COLUMNS.get(field, field)
+        if name not in reader.names:
+          continue
+        fit = residual_decay_rate(iterations, reader.column(name))
+        slope, remaining = None, None
+        if fit is not None:
+          slope, value = fit
+          if value <= target:
+            remaining = 0.0
+          elif slope < 0:
+            remaining = (target - value) / slope
+        remaining_all.append(remaining)
+        estimates.append(convergence_row(field, slope, remaining, iterations[-1], rate))
+      if len(estimates) > 1:
+        remaining = None if None in remaining_all else max(remaining_all)
+        estimates.append(convergence_row("all", None, remaining, iterations[-1], rate))
+
+    state.convergence_estimates = estimates
+    state.convergence_iteration_rate = f"{rate:.2f} iterations/s" if rate else "-"
+
+
+def convergence_estimate_card():
+    with vuetify.VCard(flat=True, classes="pa-1", style="min-width: 280px;"):
+      vuetify.VCardTitle("Convergence", classes="py-1 text-subtitle-2")
+      vuetify.VCardSubtitle("{{ convergence_iteration_rate }}, target {{ convergence_val }}", classes="py-1")
+      with vuetify.VSimpleTable(dense=True):
+        with html.Thead():
+          with html.Tr():
+            html.Th("Field")
+            html.Th("Rate (decades/iter)")
+            html.Th("Iteration")
+            html.Th("Time left")
+        with html.Tbody():
+          with html.Tr(v_for="row in convergence_estimates", key="row.field"):
+            html.Td("{{ row.field }}")
+            html.Td("{{ row.rate }}")
+            html.Td("{{ row.iteration }}")
+            html.Td("{{ row.time }}")
 
 
 ###############################################################################
 # read restart file (binary or ASCII)
-def Read_SU2_Restart_Binary(val_filename):
+# SU2 binary restart file: 5 ints (magic number, number of fields, number of points, 2 unused),
+# the field names with a fixed width and then the values of all fields of every point (doubles)
+SU2_RESTART_MAGIC = 535532
+SU2_RESTART_STRING_SIZE = 33
+
+# the header of a binary restart file: the byte order, the number of points and the field names.
+# returns None if the file is not in SU2 binary format
+def _read_restart_binary_header(f):
+    header = f.read(5 * 4).ljust(5 * 4, b'\0')
+    # native byte order, but also read files from a machine with the other byte order
+    for byteorder in ('<', '>'):
+        Restart_Vars = np.frombuffer(header, dtype=byteorder + 'i4')
+        if Restart_Vars[0] == SU2_RESTART_MAGIC:
+            break
+    else:
+        return None
+
+    nFields, nPointFile = int(Restart_Vars[1]), int(Restart_Vars[2])
+    names = f.read(nFields * SU2_RESTART_STRING_SIZE)
+    fields = [name.decode('utf-8', errors='replace').strip().strip('"')
+              for name in np.frombuffer(names, dtype=f'S{SU2_RESTART_STRING_SIZE}')]
+    return {"byteorder": byteorder, "npoints": nPointFile, "fields": fields, "header": header + names}
+
+
+# columns: only read these fields (all fields if None)
+def Read_SU2_Restart_Binary(val_filename, columns=None):
     val_filename = str(val_filename)
     fname = val_filename
-    nRestart_Vars = 5
-    Restart_Vars = [0] * nRestart_Vars
-    fields = []
-    
+
     try:
-        # Always try ASCII format first since we have issues with binary
-        log("info", "Reading restart file in ASCII format")
-        try:
-            # Try loading as CSV first (simplest case)
-            df = pd.read_csv(fname)
-            log("info", f"Successfully loaded restart file as CSV with {len(df)} rows")
-            return df
-        except Exception as e:
-            log("info", f"Could not read as CSV, trying custom ASCII parsing: {e}")
-            
-            try:
-                with open(fname, "r", errors='replace') as f:
-                    try:
-                        # Simple parsing of ASCII restart file
-                        lines = f.readlines()
-                        if len(lines) > 0:
-                            header = lines[0].strip().split()
-                            if len(header) >= 3:
-                                # Extract nFields and nPointFile from header
-                                try:
-                                    nFields = int(header[1])
-                                    nPointFile = int(header[2])
-                                    Restart_Vars[1] = nFields
-                                    Restart_Vars[2] = nPointFile
-                                except ValueError:
-                                    log("error", "Failed to parse ASCII restart file header")
-                                    raise
-                        
-                        # Get field names from the second line
-                        if len(lines) > 1:
-                            field_names = lines[1].strip().split()
-                            fields = field_names
-                            
-                        # Parse data lines
-                        data = []
-                        for i in range(2, len(lines)):
-                            try:
-                                values = [float(val) for val in lines[i].strip().split()]
-                                if len(values) == len(fields):
-                                    data.append(values)
-                            except:
-                                pass
-                        
-                        df = pd.DataFrame(data, columns=fields)
-                        log("info", f"Successfully parsed ASCII restart file with {len(df)} rows")
-                        return df
-                    except Exception as e:
-                        log("error", f"Error parsing ASCII restart file: {e}")
-            except UnicodeDecodeError:
-                log("info", "File appears to be binary. Attempting binary read.")
-                # Here we would handle binary format, but currently just returning empty DataFrame
-                # For binary formats, you would need specific binary parsing logic
+        with open(fname, "rb") as f:
+            header = _read_restart_binary_header(f)
+            if header is None:
+                log("info", "Restart file is not in SU2 binary format, reading it as ASCII")
+                return Read_SU2_Restart_ASCII(fname, columns)
+
+            fields, nPointFile = header["fields"], header["npoints"]
+            nFields = len(fields)
+            data_offset = f.tell()
+            if os.fstat(f.fileno()).st_size < data_offset + nFields * nPointFile * 8:
+                log("error", f"Restart file {fname} is incomplete")
                 return pd.DataFrame()
-    except Exception as e:
+
+        selected = [i for i, name in enumerate(fields) if columns is None or name in columns]
+        # the values are stored point by point, copy them into one contiguous array per field.
+        # the copy is needed anyway and the file can be overwritten by the solver afterwards
+        data = np.memmap(fname, dtype=header["byteorder"] + 'f8', mode='r', offset=data_offset, shape=(nPointFile, nFields))
+        values = np.empty((len(selected), nPointFile), dtype=np.float64)
+        if len(selected) == nFields:
+            values[:] = data.T
+        else:
+            for j, i in enumerate(selected):
+                values[j] = data[:, i]
+        del data
+    except (OSError, ValueError) as e:
         log("error", f"Failed to read restart file: {e}")
-    
+        return pd.DataFrame()
+
+    log("info", f"Successfully read binary restart file with {nPointFile} points and {len(selected)} of {nFields} fields")
+    # the transposed view is stored by pandas as it is, without copying the columns
+    return pd.DataFrame(values.T, columns=[fields[i] for i in selected], copy=False)
+
+
+# restart files in csv format are read in blocks of text of this size (bytes), this bounds the memory use
+SU2_RESTART_CSV_BLOCK_SIZE = 1 << 24
+
+# SU2 restart file in csv format, read with the pyarrow csv reader when it is installed, otherwise with the pandas c parser.
+# the values are read as float32 (the point ids as integers) block by block, the blocks of a column are joined at the end.
+# the dataframe uses the column arrays as they are, without copying
+# columns: only read these fields (all fields if None)
+def Read_SU2_Restart_CSV(val_filename, columns=None):
+    fname = str(val_filename)
+    names = list(pd.read_csv(fname, nrows=0).columns)
+    if len(names) < 2:
+        raise ValueError(f"{fname} is not a csv file")
+    selected = [name for name in names if columns is None or name in columns]
+    dtypes = {name: (np.int64 if name == 'PointID' else np.float32) for name in selected}
+    blocks = {name: [] for name in selected}
+
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        pacsv = None
+
+    if pacsv is not None:
+        # the columns are named by their position, so the names are the same as the ones pandas reads from the header
+        keys = {name: str(names.index(name)) for name in selected}
+        reader = pacsv.open_csv(fname,
+            read_options=pacsv.ReadOptions(column_names=[str(i) for i in range(len(names))], skip_rows=1,
+                                           block_size=SU2_RESTART_CSV_BLOCK_SIZE),
+            convert_options=pacsv.ConvertOptions(include_columns=list(keys.values()),
+                                                 column_types={keys[name]: pa.from_numpy_dtype(dtypes[name]) for name in selected}))
+        for batch in reader:
+            for name in selected:
+                blocks[name].append(batch.column(keys[name]).to_numpy())
+    else:
+        # about 16 characters per value
+        rows = max(SU2_RESTART_CSV_BLOCK_SIZE // (16 * len(names)), 1)
+        for chunk in pd.read_csv(fname, usecols=selected, dtype=dtypes, chunksize=rows):
+            for name in selected:
+                blocks[name].append(chunk[name].to_numpy())
+
+    data = {name: np.concatenate(blocks[name]) if blocks[name] else np.zeros(0, dtype=dtypes[name]) for name in selected}
+    return pd.DataFrame(data, copy=False)
+
+
+# SU2 restart file in ASCII format (csv, or whitespace separated with a header line)
+def Read_SU2_Restart_ASCII(val_filename, columns=None):
+    fname = str(val_filename)
+
+    log("info", "Reading restart file in ASCII format")
+    try:
+        # Try loading as CSV first (simplest case)
+        df = Read_SU2_Restart_CSV(fname, columns)
+        log("info", f"Successfully loaded restart file as CSV with {len(df)} rows")
+        return df
+    except Exception as e:
+        log("info", f"Could not read as CSV, trying custom ASCII parsing: {e}")
+
+    # the first line has the number of fields and points, the second line the field names
+    try:
+        with open(fname, "r", errors='replace') as f:
+            header = f.readline().split()
+            if len(header) >= 3:
+                log("info", f"ASCII restart file with {header[1]} fields and {header[2]} points")
+            fields = f.readline().split()
+            data = np.loadtxt(f, dtype=np.float32, ndmin=2)
+        df = pd.DataFrame({name: np.ascontiguousarray(data[:, i]) for i, name in enumerate(fields)
+                           if columns is None or name in columns}, copy=False)
+        log("info", f"Successfully parsed ASCII restart file with {len(df)} rows")
+        return df
+    except Exception as e:
+        log("error", f"Error parsing ASCII restart file: {e}")
+
     log("info", "Unable to read restart file")
     return pd.DataFrame()
 
@@ -568,6 +850,12 @@ def uploadRestart(restartFile, **kwargs):
     log("debug", "removed file")
     return
 
+  # the restart file is read into the grid, which is replaced when the mesh is loaded.
+  # it is applied when the mesh was loaded, see load_file_su2_task()
+  if state.mesh_loading:
+    log("info", "the mesh is being loaded, the restart file is read afterwards")
+    return
+
   # check if the case name is set
   if not checkCaseName():
     state.restartFile = None
@@ -576,7 +864,24 @@ def uploadRestart(restartFile, **kwargs):
   # Set READ_BINARY_RESTART to false to ensure we can read different types of restart files
   state.jsonData["READ_BINARY_RESTART"] = False
 
-  filename = restartFile['name']
+  # the name comes from the client, the file is always written in the case directory
+  filename = os.path.basename(restartFile['name'])
+
+  # restart file on the server, e.g. of a case that is loaded: read it from disk.
+  # only the files that the server registered itself (see core/server_files.py)
+  server_path = server_file_path(restartFile)
+  if server_path:
+    restart_path = BASE / "user" / state.case_name / filename
+    if not restart_path.exists() or not os.path.samefile(server_path, restart_path):
+      shutil.copyfile(server_path, restart_path)
+
+    state.jsonData["SOLUTION_FILENAME"] = filename
+    state.jsonData["RESTART_SOL"] = True
+    state.jsonData["READ_BINARY_RESTART"] = filename.endswith(".dat")
+    readRestart(restart_path, True, initialization='.dat' if filename.endswith(".dat") else '.csv')
+    log("info", "Restart loaded ")
+    return
+
   file = ClientFile(restartFile)
 
   base_path = Path("e:/gsoc/su2gui/user") / state.case_name
@@ -644,8 +949,191 @@ def uploadRestart(restartFile, **kwargs):
 #
 #    return False
 
+# components of the restart fields that are combined into a 3-component vector array, e.g. Velocity_x, Velocity_y, Velocity_z
+RESTART_VECTOR_SUFFIXES = ("_x", "_y", "_z")
+
+# the restart file that is refreshed during a live run, see readRestart:
+# the signature (size, modification time, header) of the file when it was last read,
+# the fields in the file and the fields that were read (the point data arrays of the other fields are not in the grid)
+_live_restart = {"filename": None, "signature": None, "fields": [], "loaded": set()}
+
+# wrap a numpy array in a vtk array without copying the values.
+# numpy_to_vtk keeps a reference to the numpy array in the vtk array, so the buffer lives as long as the vtk array
+def vtk_point_array(name, values):
+  if values.dtype not in (np.float32, np.float64):
+    values = values.astype(np.float64)
+  ArrayObject = numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=False)
+  ArrayObject.SetName(name)
+  return ArrayObject
+
+# the fields of the restart columns as a list of (name, columns).
+# the x, y and z components of a vector are one field, a missing z component (2D) is None
+def restart_fields(columns):
+  fields = []
+  for name in columns:
+    # let's skip these 
+    if (name in ['PointID','x','y']):
+      continue
+    prefix, suffix = name[:-2], name[-2:]
+    if suffix in RESTART_VECTOR_SUFFIXES and prefix + "_x" in columns and prefix + "_y" in columns:
+      if suffix == "_x":
+        fields.append((prefix, [prefix + s if prefix + s in columns else None for s in RESTART_VECTOR_SUFFIXES]))
+    else:
+      fields.append((name, [name]))
+  return fields
+
+# the entries of the "Color by" list for the restart fields, arrays are the vtk arrays of the fields that were read.
+# a vector gets an entry for the magnitude and one for every component,
+# the component entries color by the vector array (see set_lut_component).
+# the range of a field that was not read is None, it is read when it is selected (see load_restart_field)
+def restart_dataset_arrays(fields, arrays):
+  datasetArrays = []
+  for name, columns in fields:
+    ArrayObject = arrays.get(name)
+    if len(columns) == 1:
+      datasetArrays.append({"text": name, "range": list(ArrayObject.GetRange()) if ArrayObject else None})
+      continue
+    datasetArrays.append({"text": name, "array": name, "component": -1,
+                          "range": list(ArrayObject.GetRange(-1)) if ArrayObject else None})
+    for icomp, column in enumerate(columns):
+      if column is not None:
+        datasetArrays.append({"text": column, "array": name, "component": icomp,
+                              "range": list(ArrayObject.GetRange(icomp)) if ArrayObject else None})
+  for counter, datasetArray in enumerate(datasetArrays):
+    datasetArray["value"] = counter
+    datasetArray["type"] = vtkDataObject.FIELD_ASSOCIATION_POINTS
+  return datasetArrays
+
+# the mesh point of every restart row, from the PointID column (SU2 can write the points in another order, e.g. with MPI).
+# returns None when the rows are in the order of the mesh points, so the values do not have to be reordered.
+# raises a ValueError that tells why the rows do not match the mesh points
+def restart_point_ids(df, npoints):
+  if len(df) != npoints:
+    raise ValueError(f"the restart file has {len(df)} points, the mesh has {npoints} points")
+  if 'PointID' not in df.keys() or npoints == 0:
+    return None
+  ids = df['PointID'].to_numpy()
+  if not np.issubdtype(ids.dtype, np.integer):
+    if not np.all(np.isfinite(ids)) or np.any(ids != np.round(ids)):
+      raise ValueError("the PointID column of the restart file has values that are not integers")
+    ids = ids.astype(np.int64)
+  if ids[0] == 0 and np.all(np.diff(ids) == 1):
+    return None
+  outside = np.count_nonzero((ids < 0) | (ids >= npoints))
+  if outside:
+    raise ValueError(f"{outside} point ids of the restart file are not in the range 0..{npoints - 1} of the mesh points")
+  missing = np.count_nonzero(np.bincount(ids, minlength=npoints) == 0)
+  if missing:
+    raise ValueError(f"{missing} mesh points have no values in the restart file, their point ids are used more than once")
+  return ids
+
+# convert the restart data to vtk point data arrays, in the order of the npoints mesh points (see restart_point_ids)
+# returns the number of points, the vtk arrays and the dataset_arrays for the gui
+def restart_arrays(df, npoints):
+  ids = restart_point_ids(df, npoints)
+  arrays = {}
+  fields = []
+  for name, columns in restart_fields(list(df.keys())):
+    log("info", f"reading restart, field name =  = {name}")
+    values = [df[column].to_numpy() for column in columns if column is not None]
+    if not all(np.issubdtype(v.dtype, np.number) for v in values):
+      log("info", f"Could not convert restart field {name}")
+      continue
+    # the components of a vector are copied into one array, a single column is not copied
+    if len(columns) > 1:
+      values = [df[column].to_numpy() if column is not None else np.zeros(len(df), dtype=values[0].dtype) for column in columns]
+    values = values[0] if len(values) == 1 else np.column_stack(values)
+    if ids is not None:
+      # row i of the restart file has the values of mesh point ids[i]
+      ordered = np.empty_like(values)
+      ordered[ids] = values
+      values = ordered
+    arrays[name] = vtk_point_array(name, values)
+    fields.append((name, columns))
+
+  return {"npoints": len(df), "arrays": list(arrays.values()), "dataset_arrays": restart_dataset_arrays(fields, arrays)}
+
+# the point data arrays of a saved case (see save_vtm) in the same format as restart_arrays
+def point_data_restart(arrays):
+  fields = []
+  for ArrayObject in arrays:
+    name = ArrayObject.GetName()
+    if ArrayObject.GetNumberOfComponents() == 1:
+      fields.append((name, [name]))
+    else:
+      # the z component of a 2D vector is zero and is not listed
+      fields.append((name, [name + s for s in RESTART_VECTOR_SUFFIXES[:2]] +
+                     [name + "_z" if ArrayObject.GetRange(2) != (0.0, 0.0) else None]))
+  npoints = arrays[0].GetNumberOfTuples() if arrays else 0
+  return {"npoints": npoints, "arrays": arrays,
+          "dataset_arrays": restart_dataset_arrays(fields, {ArrayObject.GetName(): ArrayObject for ArrayObject in arrays})}
+
+# signature and column names of a restart file, read from the header only. None if the file cannot be read
+# complete: the file has all the values of the header (binary) or ends with a complete line (ASCII)
+def restart_header(restartFile):
+  try:
+    with open(restartFile, "rb") as f:
+      stat = os.fstat(f.fileno())
+      binary = _read_restart_binary_header(f)
+      if binary is not None:
+        header, columns = binary["header"], binary["fields"]
+        complete = stat.st_size >= len(header) + 8 * len(columns) * binary["npoints"]
+      else:
+        f.seek(0)
+        header = f.readline()
+        columns = list(pd.read_csv(io.BytesIO(header), nrows=0).columns)
+        f.seek(-1, os.SEEK_END)
+        complete = f.read(1) == b"\n"
+  except (OSError, ValueError, pd.errors.EmptyDataError) as e:
+    log("info", f"Unable to read the header of the restart file {restartFile}: {e}")
+    return None
+  return {"signature": (stat.st_size, stat.st_mtime_ns, header), "columns": columns, "complete": complete}
+
+# the field names of the active "Color by" entry and of the pinned fields, these are read on every live refresh
+def live_restart_fields():
+  names = set(state.restart_pinned_fields or [])
+  if state.dataset_arrays and 0 <= state.mesh_color_array_idx < len(state.dataset_arrays):
+    array = state.dataset_arrays[state.mesh_color_array_idx]
+    names.add(array.get("array", array.get("text")))
+  return names
+
+# read the field of a "Color by" entry that was not read during the last live refresh.
+# returns the updated entry, or None if the field could not be read
+def load_restart_field(array):
+  if array.get("range") is not None:
+    return array
+  if _live_restart["filename"] is not None:
+    readRestart(_live_restart["filename"], False, live=True)
+  for entry in state.dataset_arrays:
+    if entry.get("text") == array.get("text") and entry.get("range") is not None:
+      return entry
+  log("warn", f"Unable to read the field {array.get('text')} from the restart file")
+  return None
+
+# keep the shown and pinned fields of a new restart in the snapshots.
+# the slider follows the newest snapshot, or keeps showing the same snapshot when it was moved back
+def store_restart_snapshot(arrays):
+  names = live_restart_fields()
+  newest = state.restart_snapshot_idx >= len(state.restart_snapshot_iterations) - 1
+  # the number of snapshots that was set last (see update_restart_snapshots)
+  full = len(state.restart_snapshot_iterations) >= restart_snapshot_size()
+  add_restart_snapshot(state.global_iter, [ArrayObject for ArrayObject in arrays if ArrayObject.GetName() in names])
+  state.restart_snapshot_iterations = restart_snapshot_iterations()
+  if newest:
+    state.restart_snapshot_idx = len(state.restart_snapshot_iterations) - 1
+  elif full:
+    state.restart_snapshot_idx = max(state.restart_snapshot_idx - 1, 0)
+
+# replace the arrays of the grid with the arrays of a snapshot
+def show_restart_snapshot(index):
+  for ArrayObject in restart_snapshot_arrays(index):
+    grid.GetPointData().AddArray(ArrayObject)
+  grid.GetPointData().Modified()
+
 # read the restart file
 # reset_active_field is used to show the active field
+# live: only read the fields that are shown or pinned (see live_restart_fields) and skip the update
+# when the file did not change since the last time it was read
 def readRestart(restartFile, reset_active_field, **kwargs):
 
   # check and add extension if needed
@@ -656,76 +1144,96 @@ def readRestart(restartFile, reset_active_field, **kwargs):
     if kwargs['initialization']=='.dat':
        # Set READ_BINARY_RESTART to False when reading restart files
        state.jsonData['READ_BINARY_RESTART'] = False
-       df = Read_SU2_Restart_Binary(restartFile)
-    else:
-        df = pd.read_csv(restartFile)
+    # the restart of a recently opened case is still in memory
+    restart = case_cache_get("restart", restartFile)
+    if restart is None:
+      if kwargs['initialization']=='.dat':
+        df = Read_SU2_Restart_Binary(restartFile)
+      else:
+        df = Read_SU2_Restart_CSV(restartFile)
+      try:
+        restart = restart_arrays(df, grid.GetPoints().GetNumberOfPoints())
+      except ValueError as e:
+        log("error", f"The restart file {restartFile} does not match the mesh: {e}")
+        return
+      case_cache_put("restart", restartFile, restart)
+    _live_restart.update(filename=None, signature=None, fields=[], loaded=set())
   else:
-    # move the file to prevent that the file is overwritten while reading
-    # the file can still be overwritten while renaming, but the time window is smaller
-    # we also try to prevent this by not calling readRestart when we are about to write a file
-    # (based on current iteration number)
+    header = restart_header(restartFile)
+    if header is None:
+      return
+    fields = restart_fields(header["columns"])
+    unchanged = (restartFile == _live_restart["filename"] and header["signature"] == _live_restart["signature"])
+    if kwargs.get('live'):
+      names = live_restart_fields()
+      # the active field can be a component of a vector, or a field of the initialization
+      wanted = [(name, columns) for name, columns in fields if name in names or names.intersection(columns)]
+      if not wanted:
+        wanted = fields[:1]
+    else:
+      wanted = fields
+    if unchanged:
+      # the fields that were already read are still up to date
+      wanted = [(name, columns) for name, columns in wanted if name not in _live_restart["loaded"]]
+      if not wanted:
+        log("debug", "restart file did not change, skipping update")
+        return
+
+    # the solver can still be writing the file (see FileWatch), the file is only read when it is complete
+    # and the data is only used when the file did not change while it was read
+    if not header["complete"]:
+      log("info", "Restart file is incomplete, skipping update")
+      return
+    columns = ['PointID'] + [column for _, field_columns in wanted for column in field_columns if column is not None]
     try:
-        lock_file = restartFile + ".lock"
-
-        # Copy or overwrite the lock_file with the contents of restartFile
-        # shutil.copy2 handles binary files correctly
-        shutil.copy2(restartFile, lock_file)
-
-        # Read the lock_file based on the state
         if state.fileio_restart_binary or restartFile.endswith(".dat"):
-            df = Read_SU2_Restart_Binary(lock_file)
+            df = Read_SU2_Restart_Binary(restartFile, columns)
         else:
-            df = pd.read_csv(lock_file)
+            df = Read_SU2_Restart_CSV(restartFile, columns)
     except Exception as e:
         log("info", f"Unable to read restart file. It may not be available yet or is being used by another process.\n  {e}")
         df = pd.DataFrame()
-
-
-  # check if the points and cells match, if not then we probably were writing to the file
-  # while reading it and we just skip this update
-  log("info", f"number of points read =  = {len(df)}")
-  log("info", f"number of points expected =  = {grid.GetPoints().GetNumberOfPoints()}")
-  if len(df) != grid.GetPoints().GetNumberOfPoints():
-    log("info", "Restart file is invalid, skipping update")
+    if file_signature(restartFile) != header["signature"][:2]:
+      log("info", "Restart file was written while reading it, skipping update")
+      return
+    try:
+      restart = restart_arrays(df, grid.GetPoints().GetNumberOfPoints())
+    except ValueError as e:
+      log("info", f"Restart file does not match the mesh, skipping update: {e}")
+      return
+
+    loaded = {ArrayObject.GetName() for ArrayObject in restart["arrays"]}
+    if unchanged:
+      loaded |= _live_restart["loaded"]
+    else:
+      # the other fields are from an older solution
+      for name, _ in fields:
+        if name not in loaded:
+          grid.GetPointData().RemoveArray(name)
+    _live_restart.update(filename=restartFile, signature=header["signature"], fields=fields, loaded=loaded)
+    if state.restart_snapshots and not unchanged:
+      store_restart_snapshot(restart["arrays"])
+    for ArrayObject in restart["arrays"]:
+      grid.GetPointData().AddArray(ArrayObject)
+    arrays = {name: grid.GetPointData().GetArray(name) for name in loaded}
+    restart["dataset_arrays"] = restart_dataset_arrays(fields, arrays)
+
+  # the restart of a recently opened case can be from another mesh
+  if restart['npoints'] != grid.GetPoints().GetNumberOfPoints():
+    log("error", f"The restart file has {restart['npoints']} points, the mesh has {grid.GetPoints().GetNumberOfPoints()} points")
     return
 
-  # construct the dataset_arrays
-  datasetArrays = []
-  counter=0
-  for key in df.keys():
-    name = key
-    log("info", f"reading restart, field name =  = {name}")
-    # let's skip these 
-    if (name in ['PointID','x','y']):
-      continue
-
-    ArrayObject = vtk.vtkFloatArray()
-    ArrayObject.SetName(name)
-    # all components are scalars, no vectors for velocity
-    ArrayObject.SetNumberOfComponents(1)
-    # how many elements do we have?
-    nElems = len(df[name])
-    ArrayObject.SetNumberOfValues(nElems)
-    ArrayObject.SetNumberOfTuples(nElems)
+  show_restart(restart, reset_active_field)
+  # the slider was moved back to an older snapshot
+  if state.restart_snapshots and state.restart_snapshot_idx < len(state.restart_snapshot_iterations) - 1:
+    show_restart_snapshot(state.restart_snapshot_idx)
 
-    # Nijso: TODO FIXME very slow!
-    for i in range(nElems):
-      ArrayObject.SetValue(i,df[name][i])
 
+# add the restart arrays to the grid and color the grid by the first (reset_active_field) or the active array
+def show_restart(restart, reset_active_field):
+  for ArrayObject in restart["arrays"]:
     grid.GetPointData().AddArray(ArrayObject)
-
-    datasetArray = {
-                "text": name,
-                "value": counter,
-                "type": vtkDataObject.FIELD_ASSOCIATION_POINTS,
-            }
-
-    try:
-        datasetArray["range"] = [df[name].min(), df[name].max()]
-    except TypeError as e:
-        log("info", f"Could not compute range for field {name}: {e}")
-    datasetArrays.append(datasetArray)
-    counter += 1
+  datasetArrays = restart["dataset_arrays"]
 
   state.dataset_arrays = datasetArrays
   #log("info", f"dataset =  = {datasetArrays}")
@@ -741,8 +1249,9 @@ def readRestart(restartFile, reset_active_field, **kwargs):
   if reset_active_field==True:
     defaultArray = datasetArrays[0]
 
-    mesh_mapper.SelectColorArray(defaultArray.get('text'))
+    mesh_mapper.SelectColorArray(defaultArray.get('array', defaultArray.get('text')))
     mesh_mapper.GetLookupTable().SetRange(defaultArray.get('range'))
+    set_lut_component(mesh_mapper.GetLookupTable(), defaultArray)
     mesh_mapper.SetScalarVisibility(True)
     mesh_mapper.SetUseLookupTableScalarRange(True)
 
@@ -780,37 +1289,89 @@ def figure_size():
 
 
 
-###############################################################################
-def mpl_plot_history():
-    plt.close('all')
-    fig, ax = plt.subplots(1, 1, **figure_size(), facecolor='blue')
-    ax.set_facecolor('#eafff5')
-    fig.set_facecolor('blue')
-    fig.patch.set_facecolor('blue')
-    fig.subplots_adjust(top=0.98, bottom=0.15, left=0.05, right=0.99, hspace=0.0, wspace=0.0)
-
-    has_lines = False
+# width of the history plot (pixels) when the size of the figure is not known yet
+HISTORY_PLOT_WIDTH = 1000
 
+# first and last (+1) iteration of the history plot, from the range slider in percent of the iterations
+def history_plot_range(niter):
     try:
-        for idx in state.monitorLinesRange:
-            if state.monitorLinesVisibility[idx]:
-                ax.plot(state.x, state.ylist[idx], label=state.monitorLinesNames[idx], linewidth=5, markersize=20, markeredgewidth=10, color=mplColorList[idx % 20])
-                has_lines = True
+        low, high = (float(v) for v in state.history_plot_range)
+    except (TypeError, ValueError):
+        low, high = 0.0, 100.0
+    start = min(max(int(niter * low / 100.0), 0), niter)
+    end = min(max(int(np.ceil(niter * high / 100.0)), start + 1), niter)
+    return start, end
 
+###############################################################################
+# the history figure is made once, the lines are updated in place.
+# lines: the line of every shown history column (index, name), legend: the columns in the legend,
+# key: the data and settings of the figure that was sent to the client (see update_chart)
+_history_figure = {"fig": None, "ax": None, "lines": {}, "legend": None, "key": None}
+
+# everything the history figure depends on
+def history_figure_key(active_figure):
+    reader = _history["reader"]
+    return (active_figure, id(reader), reader.version if reader else None, repr(state.figure_size),
+            repr(state.monitorLinesNames), repr(state.monitorLinesVisibility), repr(state.history_plot_range))
+
+def history_figure():
+    fig = _history_figure["fig"]
+    if fig is None:
+        fig, ax = plt.subplots(1, 1, **figure_size(), facecolor='blue')
+        ax.set_facecolor('#eafff5')
+        fig.set_facecolor('blue')
+        fig.patch.set_facecolor('blue')
+        fig.subplots_adjust(top=0.98, bottom=0.15, left=0.05, right=0.99, hspace=0.0, wspace=0.0)
         ax.set_xlabel('iterations', labelpad=10)
         ax.set_ylabel('residuals', labelpad=-15)
         ax.grid(True, color="lightgray", linestyle="solid")
+        _history_figure.update(fig=fig, ax=ax, lines={}, legend=None, key=None)
+    else:
+        size = figure_size()
+        if size:
+            fig.set_dpi(size["dpi"])
+            fig.set_size_inches(size["figsize"])
+    return fig, _history_figure["ax"]
 
-        if has_lines:
-            ax.legend(framealpha=1, facecolor='white')
+def mpl_plot_history():
+    fig, ax = history_figure()
+    lines = _history_figure["lines"]
+
+    x, ylist = history_lines()
+    # the iterations in the range of the history slider (in percent of the iterations)
+    start, end = history_plot_range(len(x))
+    # about one bucket of the decimation per pixel of the figure
+    width = state.figure_size.get("size", {}).get("width", HISTORY_PLOT_WIDTH) if state.figure_size else HISTORY_PLOT_WIDTH
 
-        ax.autoscale(enable=True, axis="x")
-        ax.autoscale(enable=True, axis="y")
+    idx = None
+    try:
+        shown = [(idx, state.monitorLinesNames[idx]) for idx in state.monitorLinesRange if state.monitorLinesVisibility[idx]]
+
+        # lines are only added and removed when the visibility (or the history file) changes
+        for key in list(lines):
+            if key not in shown:
+                lines.pop(key).remove()
+        for idx, name in shown:
+            if (idx, name) not in lines:
+                lines[(idx, name)], = ax.plot([], [], label=name, linewidth=5, markersize=20, markeredgewidth=10, color=mplColorList[idx % 20])
+            points = start + decimate_min_max(ylist[idx][start:end], width)
+            lines[(idx, name)].set_data(x[points], ylist[idx][points])
+
+        if shown != _history_figure["legend"]:
+            if shown:
+                # the legend follows the order of the history columns
+                ax.legend([lines[key] for key in shown], [name for _, name in shown], framealpha=1, facecolor='white')
+            elif ax.get_legend() is not None:
+                ax.get_legend().remove()
+            _history_figure["legend"] = shown
+
+        ax.relim()
+        ax.autoscale_view()
 
     except IndexError as e:
         log("error", f"IndexError                         : {e}. Index causing error: {idx}")
-        log("error", f"state.x length                     : {len(state.x)}")
-        log("error", f"state.ylist length                 : {len(state.ylist)}")
+        log("error", f"x length                           : {len(x)}")
+        log("error", f"ylist length                       : {len(ylist)}")
         log("error", f"state.monitorLinesNames length     : {len(state.monitorLinesNames), state.monitorLinesNames}")
         log("error", f"state.monitorLinesVisibility length: {len(state.monitorLinesVisibility)}")
         log("error", f"mplColorList length                : {len(mplColorList)}")
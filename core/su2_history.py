@@ -0,0 +1,201 @@
+# su2_history.py
+# incremental reader of the SU2 convergence history file (history.csv), and decimation of the history lines for plotting
+#
+# the solver appends a line to the history file every iteration. The reader remembers the header and the
+# position up to which the file was read, and only parses the lines that were added since the last update.
+# the values are kept in numpy buffers (one row per column) that grow when they are full,
+# so an update costs time in proportion to the number of new lines, not to the length of the run.
+# note that this module does not touch the trame state.
+
+import io
+import os
+import csv
+import sys
+from pathlib import Path
+
+# Add parent directory to path to allow importing from sibling directories
+parent_dir = str(Path(__file__).parent.parent.absolute())
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import numpy as np
+
+from core.logger import log
+
+# initial number of lines of the buffers
+HISTORY_INITIAL_CAPACITY = 1024
+# the bytes before the read position that are compared to detect that the file was written again from the start
+_HISTORY_TAIL_CHECK = 64
+
+
+class SU2History:
+    """ the columns of a history file, read incrementally
+
+        usage:
+
+        history = SU2History("history.csv")
+        nnew = history.update()          # number of lines that were added since the last update
+        history.names                    # column names, without quotes and spaces
+        history.column("rms[P]")         # the values of a column (a view of the buffer)
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.reset()
+
+    def reset(self):
+        """ forget everything that was read, the next update reads the file from the start """
+        self.names = []
+        self.count = 0
+        # changes every time the data changes
+        self.version = getattr(self, "version", 0) + 1
+        self._header = b""
+        self._offset = 0
+        self._tail = b""
+        self._buffer = np.empty((0, 0))
+
+    def column(self, name):
+        return self._buffer[self.names.index(name), :self.count]
+
+    def columns(self):
+        """ the buffer rows of all columns, in the order of names """
+        return self._buffer[:, :self.count]
+
+    # the file was written again from the start when the header or the bytes before the read position changed
+    def _rewritten(self, f, size):
+        if size < self._offset:
+            return True
+        f.seek(0)
+        if f.read(len(self._header)) != self._header:
+            return True
+        f.seek(self._offset - len(self._tail))
+        return f.read(len(self._tail)) != self._tail
+
+    def _append(self, values):
+        nrows = len(values)
+        if self.count + nrows > self._buffer.shape[1]:
+            capacity = max(HISTORY_INITIAL_CAPACITY, 2 * self._buffer.shape[1], self.count + nrows)
+            buffer = np.empty((len(self.names), capacity))
+            buffer[:, :self.count] = self._buffer[:, :self.count]
+            self._buffer = buffer
+        self._buffer[:, self.count:self.count + nrows] = values.T
+        self.count += nrows
+        self.version += 1
+
+    def update(self):
+        """ read the lines that were added to the file, returns the number of new lines.
+            the last line is only read when it is complete
+        """
+        try:
+            f = open(self.filename, "rb")
+        except OSError:
+            return 0
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if self._header and self._rewritten(f, size):
+                log("info", f"history file {self.filename} was written again, reading it from the start")
+                self.reset()
+
+            if not self._header:
+                header = f.readline()
+                if not header.endswith(b"\n"):
+                    return 0
+                # get rid of quotation marks and spaces in the column names
+                self.names = [name.replace('"', '').replace(' ', '')
+                              for name in next(csv.reader([header.decode('utf-8', errors='replace')]))]
+                self._header = header
+                self._offset = len(header)
+                self._buffer = np.empty((len(self.names), 0))
+
+            f.seek(self._offset)
+            block = f.read(size - self._offset)
+
+        # only complete lines
+        end = block.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+        try:
+            values = np.loadtxt(io.BytesIO(block[:end]), delimiter=",", ndmin=2, usecols=range(len(self.names)))
+        except ValueError as e:
+            log("info", f"Unable to read the new lines of the history file {self.filename}: {e}")
+            return 0
+        self._offset += end
+        self._tail = block[max(end - _HISTORY_TAIL_CHECK, 0):end]
+        self._append(values)
+        return len(values)
+
+
+def decimate_min_max(values, nbuckets):
+    """ indices of the values to plot for a line that is nbuckets pixels wide
+
+        the values are split into nbuckets buckets of (almost) the same size, and only the smallest and the
+        largest value of every bucket are kept, so the plotted line covers the same pixels as the full line.
+        all indices are returned when there are not more than 2 values per bucket
+    """
+    n = len(values)
+    nbuckets = max(int(nbuckets), 1)
+    if n <= 2 * nbuckets:
+        return np.arange(n)
+    size = -(-n // nbuckets)
+    nfull = n // size
+    # nan values (diverged residuals) are only chosen when the bucket has no other values
+    finite = np.isfinite(values)
+    low = np.where(finite, values, np.inf)
+    high = np.where(finite, values, -np.inf)
+    starts = np.arange(nfull) * size
+    imin = starts + low[:nfull * size].reshape(nfull, size).argmin(axis=1)
+    imax = starts + high[:nfull * size].reshape(nfull, size).argmax(axis=1)
+    if nfull * size < n:
+        imin = np.append(imin, nfull * size + low[nfull * size:].argmin())
+        imax = np.append(imax, nfull * size + high[nfull * size:].argmax())
+    # the first and the last value are always kept, so the line spans the whole range
+    return np.unique(np.concatenate(([0], imin, imax, [n - 1])))
+
+
+# the columns in the history file of the residuals in CONV_FIELD
+CONV_FIELD_COLUMNS = {
+    "RMS_DENSITY": "rms[Rho]",
+    "RMS_MOMENTUM-X": "rms[RhoU]",
+    "RMS_MOMENTUM-Y": "rms[RhoV]",
+    "RMS_MOMENTUM-Z": "rms[RhoW]",
+    "RMS_ENERGY": "rms[RhoE]",
+    "RMS_PRESSURE": "rms[P]",
+    "RMS_VELOCITY-X": "rms[U]",
+    "RMS_VELOCITY-Y": "rms[V]",
+    "RMS_VELOCITY-Z": "rms[W]",
+    "RMS_TEMPERATURE": "rms[T]",
+    "RMS_NU_TILDE": "rms[nu]",
+    "RMS_TKE": "rms[k]",
+    "RMS_DISSIPATION": "rms[w]",
+}
+
+# number of history lines used for the convergence estimate
+HISTORY_CONVERGENCE_WINDOW = 100
+
+
+def residual_decay_rate(iterations, values, window=HISTORY_CONVERGENCE_WINDOW):
+    """ least squares line through the last window values of a residual (log10, as written by SU2)
+
+        returns the slope (decades per iteration) and the value of the line at the last iteration,
+        None when there are less than 2 finite values
+    """
+    x = np.asarray(iterations[-window:], dtype=np.float64)
+    y = np.asarray(values[-window:], dtype=np.float64)
+    finite = np.isfinite(y)
+    if finite.sum() < 2 or np.ptp(x[finite]) == 0:
+        return None
+    slope, intercept = np.polyfit(x[finite] - x[-1], y[finite], 1)
+    return slope, intercept
+
+
+def iteration_rate(iterations, times, window=HISTORY_CONVERGENCE_WINDOW):
+    """ iterations per second over the last window lines, None when it is not known
+
+        times is the Time(sec) column of SU2, the average wall clock time per iteration since the start,
+        so the wall clock time at an iteration is the average time multiplied by the number of iterations
+    """
+    x = np.asarray(iterations[-window:], dtype=np.float64)
+    elapsed = np.asarray(times[-window:], dtype=np.float64) * (x + 1)
+    if len(x) < 2 or not np.isfinite(elapsed[[0, -1]]).all() or elapsed[-1] <= elapsed[0]:
+        return None
+    return (x[-1] - x[0]) / (elapsed[-1] - elapsed[0])
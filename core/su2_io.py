@@ -1,6 +1,9 @@
 import vtk
 import sys
 import os
+import shutil
+import uuid
+import json
 from pathlib import Path
 
 # Add parent directory to path to allow importing from sibling directories
@@ -12,6 +15,12 @@ from core.su2_json import *
 from core.logger import log
 
 from core.su2_py_wrapper import save_json_cfg_py_file
+from core.su2_mesh import load_lazy_markers, marker_polydata_cells, open_su2_mesh_source, su2_mesh_hash
+from core.file_signature import file_signature
+
+import numpy as np
+from vtkmodules.util.numpy_support import vtk_to_numpy
+from vtkmodules.vtkIOXML import vtkXMLMultiBlockDataWriter
 
 BASE = Path(__file__).parent.parent
 
@@ -241,123 +250,294 @@ def save_json_cfg_file(filename_json_export,filename_cfg_export):
 # ##### export internal vtk multiblock mesh to an su2 file
 # ##### exports single block .su2 mesh with boundary conditions only
 ########################################################################################
+# number of elements or points that are formatted and written at once
+SU2_WRITE_CHUNK = 1 << 16
+
+
+# write a block of elements: the element type, the point ids and (for the volume elements) the element index.
+# the lines of a chunk are formatted with a single % operation on the flat array of numbers
+def write_su2_elements(f, cell_types, offsets, connectivity, with_index=False):
+    sizes = np.diff(offsets)
+    # line format for every number of nodes, the marker elements end with a space
+    end = "%d\n" if with_index else "\n"
+    formats = np.array(["%d " * (n + 1) + end for n in range(sizes.max(initial=0) + 1)], dtype=object)
+    extra = 2 if with_index else 1
+    for start in range(0, len(cell_types), SU2_WRITE_CHUNK):
+        stop = min(start + SU2_WRITE_CHUNK, len(cell_types))
+        chunk_sizes = sizes[start:stop]
+        # position of the element type of every element in the flat array of numbers
+        first = offsets[start:stop] - offsets[start] + extra * np.arange(stop - start)
+        values = np.empty(offsets[stop] - offsets[start] + extra * (stop - start), dtype=np.int64)
+        is_node = np.ones(len(values), dtype=bool)
+        values[first] = cell_types[start:stop]
+        is_node[first] = False
+        if with_index:
+            values[first + chunk_sizes + 1] = np.arange(start, stop)
+            is_node[first + chunk_sizes + 1] = False
+        values[is_node] = connectivity[offsets[start]:offsets[stop]]
+        f.write("".join(formats[chunk_sizes].tolist()) % tuple(values.tolist()))
+
+
+# write the point coordinates followed by the point index, the coordinates are written
+# as python floats (shortest representation that reads back to the same value)
+def write_su2_points(f, points, ndime):
+    line = "%r " * ndime + "%d\n"
+    for start in range(0, len(points), SU2_WRITE_CHUNK):
+        stop = min(start + SU2_WRITE_CHUNK, len(points))
+        columns = [points[start:stop, dim].astype(np.float64).tolist() for dim in range(ndime)]
+        f.write("".join(map(line.__mod__, zip(*columns, range(start, stop)))))
+
+
+########################################################################################
+# ##### skip the export when the mesh did not change
+########################################################################################
+# generation: incremented every time another mesh is set
+# origin: the file the mesh was read from, {"path", "signature", "hash"} for a file on the server or
+#         {"content", "hash"} for an uploaded file, None if the mesh is not a copy of a file
+# written: the last file that was written, {"generation", "path", "signature", "hash"}
+_mesh_export = {"generation": 0, "origin": None, "written": None}
+
+
+def set_mesh_origin(origin):
+    """ a new mesh was set, origin is the file it was read from (see _mesh_export) or None """
+    if origin is not None and origin.get("path"):
+        origin = {**origin, "signature": file_signature(origin["path"])}
+    _mesh_export["generation"] += 1
+    _mesh_export["origin"] = origin
+    _mesh_export["written"] = None
+
+
+# same hash as the mesh cache key
+def _file_hash(filename):
+    with open_su2_mesh_source({"path": os.path.abspath(filename)}) as buf:
+        return su2_mesh_hash(buf)
+
+
+# True if the file still contains the last mesh that was written to it
+def _is_written_mesh(filename):
+    written = _mesh_export["written"]
+    if written is None or written["generation"] != _mesh_export["generation"] or written["path"] != str(filename):
+        return False
+    signature = file_signature(filename)
+    if signature is None:
+        return False
+    if signature != written["signature"]:
+        # touched or copied: compare the content
+        if signature[0] != written["signature"][0] or _file_hash(filename) != written["hash"]:
+            return False
+        written["signature"] = signature
+    return True
+
+
+def _set_written_mesh(filename, digest=None):
+    _mesh_export["written"] = {"generation": _mesh_export["generation"],
+                               "path": str(filename),
+                               "signature": file_signature(filename),
+                               "hash": digest if digest is not None else _file_hash(filename)}
+
+
+# a new file is written next to the file it replaces
+def _temporary_file(filename):
+    return os.path.join(os.path.dirname(filename), ".tmp-" + uuid.uuid4().hex + "-" + os.path.basename(filename))
+
+
+# put the original mesh file at filename: a hard link (or a copy) of the file on the server
+# or the content of the uploaded file. Returns False if the original file is not available
+def _link_mesh_origin(filename):
+    origin = _mesh_export["origin"]
+    if origin is None:
+        return False
+    if origin.get("path"):
+        if file_signature(origin["path"]) != origin["signature"]:
+            # the original file has changed since it was loaded
+            return False
+        if os.path.exists(filename) and os.path.samefile(origin["path"], filename):
+            _set_written_mesh(filename, origin.get("hash"))
+            return True
+
+    # replace the file in one go, a hard link to the file must not be overwritten in place
+    tmp = _temporary_file(filename)
+    try:
+        if origin.get("path"):
+            try:
+                os.link(origin["path"], tmp)
+            except OSError:
+                # different file system, or no hard links on this file system
+                shutil.copyfile(origin["path"], tmp)
+        else:
+            with open(tmp, 'wb') as f:
+                f.write(origin["content"])
+        os.replace(tmp, filename)
+    except OSError as e:
+        log("warn", f"Could not use the original mesh file:  \n {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    _set_written_mesh(filename, origin.get("hash"))
+    return True
+
+
 def save_su2mesh(multiblock,su2_export_filename):
     log("info", type(multiblock))
     # export an su2 file
-    # first, get the dimensions. If the z-dimension is smaller than 1e-6, we assume 2D
-
-    # Set some initial values
-    #MARKER_TAG = "1"
-    #MARKER_ELEMS = 1
 
     log("info", "saving su2 mesh file")
-    #global mb1
-    #log("info", type(mb1))
-    #log("info", dir(mb1))
-    #log("info", f"nr of blocks inside block =  = {mb1.GetNumberOfBlocks(}"))
 
     internalBlock = multiblock.GetBlock(0)
     if (internalBlock==None):
         log("info", "no internal block, exiting")
         return
 
+    # nothing to do when the mesh did not change since it was loaded or written
+    filename = BASE / "user" / state.case_name / su2_export_filename
+    if _is_written_mesh(filename):
+        log("info", f"mesh is unchanged, using the existing mesh file {filename}")
+        return
+    if _link_mesh_origin(filename):
+        log("info", f"mesh is unchanged, using the original mesh file for {filename}")
+        return
+
+    if internalBlock.GetNumberOfBlocks() > 1:
+        log("error", "Saving multi-zone meshes is not supported, the mesh file was not saved")
+        return
+
     boundaryBlock = multiblock.GetBlock(1)
-    #log("info", f"nr of blocks inside internal block =  = {internalBlock.GetNumberOfBlocks(}"))
-    #log("info", f"nr of blocks inside block =  = {boundaryBlock.GetNumberOfBlocks(}"))
+    # read the markers that were not needed so far. This has to be done before writing,
+    # the markers might be read from the file that we are about to overwrite
+    try:
+        load_lazy_markers(boundaryBlock)
+    except (ValueError, OSError) as e:
+        log("error", f"Could not read the boundary markers, the mesh file was not saved:  \n {e}")
+        return
 
-    log("info", dir(internalBlock))
     # nr of data in internal block
-    NELEM = internalBlock.GetNumberOfCells()
-    NPOINT = internalBlock.GetNumberOfPoints()
-    BOUND=[0,0,0,0,0,0]
-    internalBlock.GetBounds(BOUND)
-    dz = BOUND[5] - BOUND[2]
-    log("info", f"dz = {dz}")
     NDIME= state.nDim
-    # if (dz<1e-12):
-    #     log("info", "case is 2D")
-    #     NDIME= 2
-    # else:
-    #     log("info", "dz > 0, case is 3D")
-    #     NDIME= 3
-
-    pts = vtk.vtkIdList()
-    for i in range(internalBlock.GetNumberOfBlocks()):
-        #log("info", f"number of internal elements =  = {i+1," / ", internalBlock.GetNumberOfBlocks(}") )
-        data = internalBlock.GetBlock(i)
-        celldata = data.GetCells()
-        #log("info", f"data type= = {type(data}"))
-        #log("info", f"data type= = {dir(data}"))
-        #log("info", f"celldata type= = {type(celldata}"))
-        #log("info", f"celldata type= = {dir(celldata}"))
-
-        for i in range(NELEM):
-            #log("info", i," ",celldata.GetCellSize(i))
-            celldata.GetCellAtId(i,pts)
-            #log("info", f"number of ids =  = {pts.GetNumberOfIds(}"))
-            #log("info", f"cell type = = {data.GetCellType(i}"))
-            #for j in range(pts.GetNumberOfIds()):
-            #    log("info", pts.GetId(j))
-
-
-    for i in range(internalBlock.GetNumberOfBlocks()):
-        #log("info", f"number of internal elements =  = {i+1," / ", internalBlock.GetNumberOfBlocks(}") )
-        data = internalBlock.GetBlock(i)
-        #for p in range(NPOINT):
-        #    log("info", p," ",data.GetPoint(p))
-
-
-    with open(BASE / "user" /  state.case_name /su2_export_filename, 'w') as f:
+    data = internalBlock.GetBlock(0)
+
+    # write a temporary file first, the mesh file might be a hard link to the original mesh file
+    tmp = _temporary_file(filename)
+    try:
+      _write_su2mesh(open(tmp, 'w'), NDIME, data, boundaryBlock)
+      os.replace(tmp, filename)
+    except ValueError as e:
+      os.remove(tmp)
+      log("error", f"Could not write the boundary markers, the mesh file was not saved:  \n {e}")
+      return
+    except BaseException:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+      raise
+    _set_written_mesh(filename)
+
+
+def _write_su2mesh(f, NDIME, data, boundaryBlock):
+    NELEM = data.GetNumberOfCells()
+    NPOINT = data.GetNumberOfPoints()
+
+    # the cells and points as numpy arrays, without copying
+    celldata = data.GetCells()
+    cell_types = vtk_to_numpy(data.GetCellTypesArray())
+    offsets = vtk_to_numpy(celldata.GetOffsetsArray()).astype(np.int64)
+    connectivity = vtk_to_numpy(celldata.GetConnectivityArray())
+    points = vtk_to_numpy(data.GetPoints().GetData())
+
+    with f:
       # write dimensions
-      s = "NDIME= " + str(NDIME) + "\n"
-      f.write(s)
-      # write element connectivity
-      s = "NELEM= " + str(NELEM) + "\n"
-      f.write(s)
-
+      f.write("NDIME= " + str(NDIME) + "\n")
       # write element connectivity
-      for i in range(NELEM):
-        s = str(data.GetCellType(i)) + " "
-        #log("info", i," ",celldata.GetCellSize(i))
-        celldata.GetCellAtId(i,pts)
-        #log("info", f"number of ids =  = {pts.GetNumberOfIds(}"))
-        for j in range(pts.GetNumberOfIds()):
-            #log("info", pts.GetId(j))
-            s += str(pts.GetId(j)) + " "
-        s += str(i) + "\n"
-        f.write(s)
+      f.write("NELEM= " + str(NELEM) + "\n")
+      write_su2_elements(f, cell_types, offsets, connectivity, with_index=True)
 
       # write point coordinates
-      s = "NPOIN= " + str(NPOINT) + "\n"
-      f.write(s)
-      for i in range(NPOINT):
-          p = data.GetPoint(i)
-          if (NDIME==3):
-            s = str(p[0]) + " " + str(p[1]) + " " + str(p[2]) + " " + str(i) + "\n"
-          else:
-            s = str(p[0]) + " " + str(p[1]) + " " + str(i) + "\n"
-          f.write(s)
+      f.write("NPOIN= " + str(NPOINT) + "\n")
+      write_su2_points(f, points, NDIME)
+
       # write markers
       NMARK = boundaryBlock.GetNumberOfBlocks()
-      s = "NMARK= " + str(NMARK) + "\n"
-      f.write(s)
+      f.write("NMARK= " + str(NMARK) + "\n")
       for i in range(NMARK):
-        #log("info", f"i =  = {i} {NMARK}")
-        data = boundaryBlock.GetBlock(i)
-        celldata = data.GetCells()
+        # the marker cells with the global point ids
+        cells = marker_polydata_cells(boundaryBlock.GetBlock(i))
         name = boundaryBlock.GetMetaData(i).Get(vtk.vtkCompositeDataSet.NAME())
-        s = "MARKER_TAG= " + str(name) + "\n"
-        f.write(s)
-        #log("info", f"metadata block name =  = {name}")
-        #log("info", type(data))
-        NCELLS = data.GetNumberOfCells()
-        #log("info", f"Npoints =  = {data.GetNumberOfPoints(}"))
-        s = "MARKER_ELEMS= " + str(NCELLS) + "\n"
-        f.write(s)
-        for i in range(NCELLS):
-            s = str(data.GetCellType(i)) + " "
-            celldata.GetCellAtId(i,pts)
-            for j in range(pts.GetNumberOfIds()):
-              s += str(pts.GetId(j)) + " "
-            s += "\n"
-            f.write(s)
\ No newline at end of file
+        f.write("MARKER_TAG= " + str(name) + "\n")
+        f.write("MARKER_ELEMS= " + str(len(cells["cell_types"])) + "\n")
+        write_su2_elements(f, cells["cell_types"], cells["offsets"], cells["connectivity"])
+
+
+########################################################################################
+# ##### export the internal vtk multiblock, with the point data (solution), as vtk xml files
+# ##### a .vtm file plus a directory with a .vtu file per zone and a .vtp file per marker
+########################################################################################
+# name of the saved case in the case directory, it is read instead of the mesh and restart file when the case is loaded
+CASE_VTM_FILENAME = "case.vtm"
+
+
+# name of the field data array of the saved case that records the mesh file of the case
+VTM_MESH_FILE = "MeshFile"
+
+
+# the mesh file in directory that contains the current mesh: {"name", "size", "mtime", "hash"} or None
+def _mesh_file_record(directory):
+    written = _mesh_export["written"]
+    if written is not None and written["generation"] == _mesh_export["generation"] \
+            and os.path.dirname(written["path"]) == str(directory) and _is_written_mesh(written["path"]):
+        path, digest = written["path"], written["hash"]
+    else:
+        origin = _mesh_export["origin"]
+        if origin is None or not origin.get("path") or os.path.dirname(origin["path"]) != str(directory) \
+                or file_signature(origin["path"]) != origin["signature"]:
+            return None
+        path, digest = origin["path"], origin.get("hash")
+    size, mtime = file_signature(path)
+    return {"name": os.path.basename(path), "size": size, "mtime": mtime, "hash": digest}
+
+
+# the origin of a mesh read from a saved case (see set_mesh_origin): the mesh file that
+# was recorded in the saved case, if it is still next to it and did not change
+def vtm_mesh_origin(vtm_filename, record):
+    if not record:
+        return None
+    path = os.path.join(os.path.dirname(vtm_filename), record["name"])
+    signature = file_signature(path)
+    if signature is None or signature[0] != record["size"]:
+        return None
+    if signature[1] != record["mtime"]:
+        # touched or copied: compare the content
+        if record["hash"] is None or _file_hash(path) != record["hash"]:
+            return None
+    return {"path": path, "hash": record["hash"]}
+
+
+def save_vtm(multiblock, vtm_export_filename):
+    log("info", "saving vtm file")
+    if multiblock.GetBlock(0) is None:
+        log("info", "no internal block, exiting")
+        return
+
+    # the markers that were not read yet
+    try:
+        load_lazy_markers(multiblock.GetBlock(1))
+    except (ValueError, OSError) as e:
+        log("error", f"Could not read the boundary markers, the vtm file was not saved:  \n {e}")
+        return
+
+    vtm_filename = BASE / "user" / state.case_name / vtm_export_filename
+    # the mesh file in the case directory that the mesh is a copy of, see vtm_mesh_origin()
+    record = _mesh_file_record(vtm_filename.parent)
+    if record is not None:
+        mesh_file = vtk.vtkStringArray()
+        mesh_file.SetName(VTM_MESH_FILE)
+        mesh_file.InsertNextValue(json.dumps(record))
+        multiblock.GetFieldData().AddArray(mesh_file)
+
+    writer = vtkXMLMultiBlockDataWriter()
+    writer.SetFileName(str(vtm_filename))
+    writer.SetInputData(multiblock)
+    # raw binary data at the end of every file, compressed with zlib
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.SetCompressorTypeToZLib()
+    written = writer.Write()
+    multiblock.GetFieldData().RemoveArray(VTM_MESH_FILE)
+    if written != 1:
+        log("error", f"Could not write the vtm file {vtm_export_filename}")
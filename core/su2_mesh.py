@@ -0,0 +1,702 @@
+# su2_mesh.py
+# bulk reader for .su2 mesh files
+#
+# the mesh is parsed into numpy arrays (points, cell types, offsets and connectivity),
+# which are then handed to vtk in one go instead of inserting every point and cell separately.
+# note that this module does not touch the trame state, so it can be used outside of the gui.
+
+import sys
+import os
+import mmap
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from contextlib import contextmanager
+from pathlib import Path
+
+# Add parent directory to path to allow importing from sibling directories
+parent_dir = str(Path(__file__).parent.parent.absolute())
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import numpy as np
+
+import vtk
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray, vtk_to_numpy
+from vtkmodules.vtkCommonCore import VTK_UNSIGNED_CHAR, vtkIntArray
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkIOXML import vtkXMLMultiBlockDataReader
+
+from core.server_files import server_file_info
+
+
+# number of nodes for every su2 element type. The su2 element types are the same as the vtk cell types:
+# line=3, triangle=5, quadrilateral=9, tetrahedron=10, hexahedron=12, prism/wedge=13, pyramid=14
+SU2_NODES_PER_ELEMENT = {3: 2, 5: 3, 9: 4, 10: 4, 12: 8, 13: 6, 14: 5}
+
+# lookup table, element type -> number of nodes (0 for unsupported types)
+_nodes_per_type = np.zeros(256, dtype=np.int64)
+for _type, _nodes in SU2_NODES_PER_ELEMENT.items():
+    _nodes_per_type[_type] = _nodes
+
+# size of the blocks of lines that are parsed at once, this bounds the memory use for very large meshes
+CHUNK_SIZE = 1 << 24
+
+
+# raised by a progress callback to stop reading a mesh
+class MeshLoadCancelled(Exception):
+    pass
+
+
+########################################################################################
+# ##### find all the 'KEYWORD= value' lines of the mesh file in a single pass
+########################################################################################
+def scan_su2_sections(buf):
+    # the numerical blocks do not contain an '=', so we can jump from keyword to keyword.
+    # returns a list of dicts with the keyword, its value, the start of the keyword line and
+    # the start of the line after the keyword
+    sections = []
+    pos = buf.find(b'=')
+    while pos != -1:
+        line_start = buf.rfind(b'\n', 0, pos) + 1
+        line_end = buf.find(b'\n', pos)
+        if line_end == -1:
+            line_end = len(buf)
+        key = bytes(buf[line_start:pos]).strip().decode('utf-8', errors='replace')
+        # skip comments
+        if not key.startswith('%'):
+            sections.append({"key": key,
+                             "value": bytes(buf[pos+1:line_end]).strip().decode('utf-8', errors='replace'),
+                             "start": line_start,
+                             "data": line_end + 1})
+        pos = buf.find(b'=', line_end)
+    return sections
+
+
+# split the byte range [start, end) into chunks of whole lines
+def _line_chunks(buf, start, end):
+    while start < end:
+        stop = min(start + CHUNK_SIZE, end)
+        if stop < end:
+            newline = buf.rfind(b'\n', start, stop)
+            if newline == -1:
+                # a single line longer than the chunk size, take the complete line
+                newline = buf.find(b'\n', stop, end)
+            stop = end if newline == -1 else newline + 1
+        yield start, stop
+        start = stop
+
+
+# parse a chunk of lines with whitespace separated numbers
+# returns the flat array of values and the index of the first value of every (non-empty) line
+def _parse_lines(chunk, dtype):
+    raw = np.frombuffer(chunk, dtype=np.uint8)
+    # the comments ('%' up to the end of the line) between the sections are blanked
+    comments = np.flatnonzero(raw == 37)
+    if len(comments):
+        raw = raw.copy()
+        newlines = np.append(np.flatnonzero(raw == 10), len(raw))
+        for pos, end in zip(comments, newlines[np.searchsorted(newlines, comments)]):
+            raw[pos:end] = 32
+        chunk = raw
+    # space, tab, carriage return and newline are all <= 32
+    blank = raw <= 32
+    token_start = ~blank
+    token_start[1:] &= blank[:-1]
+    starts = np.flatnonzero(token_start)
+    line_starts = np.concatenate(([0], np.flatnonzero(raw == 10) + 1))
+    # index of the first token at or after the start of every line,
+    # empty lines point to the same token as the next line
+    first = np.searchsorted(starts, line_starts)
+    first = first[np.concatenate(([True], first[1:] != first[:-1]))]
+    first = first[first < len(starts)]
+
+    values = np.fromstring(bytes(chunk), dtype=dtype, sep=' ')
+    if len(values) != len(starts):
+        raise ValueError("could not parse all the numbers in the mesh file")
+    return values, first
+
+
+########################################################################################
+# ##### parse a block of nelem elements (volume elements or boundary elements)
+########################################################################################
+def parse_su2_elements(buf, start, end, nelem, progress=None):
+    types = []
+    offsets = []
+    connectivity = []
+    nparsed = 0
+    nconn = 0
+    for chunk_start, chunk_end in _line_chunks(buf, start, end):
+        if nparsed >= nelem:
+            break
+        values, first = _parse_lines(buf[chunk_start:chunk_end], np.int64)
+        first = first[:nelem - nparsed]
+        celltypes = values[first]
+        if np.any((celltypes < 0) | (celltypes > 255)) or not np.all(_nodes_per_type[celltypes]):
+            raise ValueError(f"element type not supported: {sorted(set(celltypes.tolist()) - set(SU2_NODES_PER_ELEMENT))}")
+        nnodes = _nodes_per_type[celltypes]
+        cellsize = np.cumsum(nnodes)
+        # position of every node in the flat array of values: skip the element type and the optional element index
+        idx = np.arange(cellsize[-1]) + np.repeat(first + 1 - (cellsize - nnodes), nnodes)
+        types.append(celltypes.astype(np.uint8))
+        offsets.append(cellsize + nconn)
+        connectivity.append(values[idx])
+        nparsed += len(first)
+        nconn += cellsize[-1]
+        if progress is not None:
+            progress("cells", nparsed, nelem)
+
+    if nparsed != nelem:
+        raise ValueError(f"expected {nelem} elements but found {nparsed}")
+
+    return {"cell_types": np.concatenate(types) if types else np.zeros(0, dtype=np.uint8),
+            "offsets": np.concatenate([np.zeros(1, dtype=np.int64)] + offsets),
+            "connectivity": np.concatenate(connectivity) if connectivity else np.zeros(0, dtype=np.int64)}
+
+
+########################################################################################
+# ##### parse a block of npoin points, 2D points are put in the x-y plane (z=0)
+########################################################################################
+def parse_su2_points(buf, start, end, npoin, ndime, progress=None):
+    points = np.zeros((npoin, 3), dtype=np.float32)
+    nparsed = 0
+    for chunk_start, chunk_end in _line_chunks(buf, start, end):
+        if nparsed >= npoin:
+            break
+        values, first = _parse_lines(buf[chunk_start:chunk_end], np.float64)
+        first = first[:npoin - nparsed]
+        for dim in range(ndime):
+            points[nparsed:nparsed+len(first), dim] = values[first + dim]
+        nparsed += len(first)
+        if progress is not None:
+            progress("points", nparsed, npoin)
+
+    if nparsed != npoin:
+        raise ValueError(f"expected {npoin} points but found {nparsed}")
+    return points
+
+
+########################################################################################
+# ##### read a complete .su2 mesh into numpy arrays
+########################################################################################
+def read_su2_mesh(buf, lazy_markers=False, progress=None):
+    """ read a .su2 mesh from a bytes-like buffer
+
+        returns a dict with:
+        ndime: number of dimensions (2 or 3)
+        points: (npoin, 3) array of point coordinates
+        cell_types, offsets, connectivity: the volume elements
+        markers: list of dicts with the marker tag and its cell_types, offsets and connectivity
+        source: where the mesh was read from, needed to read lazy markers later on
+
+        a multi-zone mesh (NZONE/IZONE) returns a dict with a list of zones instead,
+        every zone is a dict as above. The zones are parsed in parallel. Use su2_mesh_zones()
+        to get the list of zones for both kinds of meshes.
+
+        lazy_markers=True: only the position and the number of elements of every marker section
+        is stored, the elements are read later with read_su2_marker()
+
+        progress(what, count, total) is called after every chunk of points, cells and markers
+        (after every zone for multi-zone meshes).
+        It can stop the reading by raising an exception, e.g. MeshLoadCancelled
+    """
+    if isinstance(buf, str):
+        buf = buf.encode('utf-8')
+    return _read_su2_mesh(buf, buf, lazy_markers, progress)
+
+
+def _read_su2_mesh(buf, source, lazy_markers, progress):
+    sections = scan_su2_sections(buf)
+    # a block of data ends where the next keyword starts
+    for i, section in enumerate(sections):
+        section["end"] = sections[i+1]["start"] if i+1 < len(sections) else len(buf)
+
+    zones = split_su2_zones(sections)
+    if len(zones) > 1:
+        return {"zones": _read_su2_zones(buf, source, zones, lazy_markers, progress)}
+
+    mesh = _read_su2_zone(buf, sections, lazy_markers, progress)
+    mesh["source"] = source
+    return mesh
+
+
+# the sections of every zone of a multi-zone mesh, a single zone mesh is one zone
+def split_su2_zones(sections):
+    izone = [i for i, section in enumerate(sections) if section["key"] == 'IZONE']
+    if not izone:
+        return [sections]
+
+    nzone = next((int(s["value"]) for s in sections if s["key"] == 'NZONE'), None)
+    if nzone is not None and nzone != len(izone):
+        raise ValueError(f"expected {nzone} zones but found {len(izone)}")
+    return [sections[i+1:j] for i, j in zip(izone, izone[1:] + [len(sections)])]
+
+
+# the list of zones of a mesh returned by read_su2_mesh
+def su2_mesh_zones(mesh):
+    return mesh["zones"] if "zones" in mesh else [mesh]
+
+
+# read a single zone, given the sections of the zone
+def _read_su2_zone(buf, sections, lazy_markers=False, progress=None):
+    def find(key):
+        section = next((s for s in sections if s["key"] == key), None)
+        if section is None:
+            raise ValueError(f"{key} not found in mesh file")
+        return section
+
+    ndime = int(find('NDIME')["value"])
+
+    section = find('NPOIN')
+    npoin = int(section["value"].split()[0])
+    points = parse_su2_points(buf, section["data"], section["end"], npoin, ndime, progress)
+
+    section = find('NELEM')
+    mesh = parse_su2_elements(buf, section["data"], section["end"], int(section["value"]), progress)
+    mesh["ndime"] = ndime
+    mesh["points"] = points
+
+    # the markers, every MARKER_TAG is followed by MARKER_ELEMS
+    mesh["markers"] = []
+    nmark = int(find('NMARK')["value"])
+    for i, section in enumerate(sections):
+        if section["key"] != 'MARKER_TAG':
+            continue
+        elems = sections[i+1] if i+1 < len(sections) else {"key": None}
+        if elems["key"] != 'MARKER_ELEMS':
+            raise ValueError(f"MARKER_ELEMS not found for marker {section['value']}")
+        marker = {"tag": section["value"],
+                  "nelem": int(elems["value"]),
+                  "data": elems["data"],
+                  "end": elems["end"]}
+        if not lazy_markers:
+            marker.update(read_su2_marker(buf, marker))
+        mesh["markers"].append(marker)
+        if progress is not None:
+            progress("markers", len(mesh["markers"]), nmark)
+
+    if len(mesh["markers"]) != nmark:
+        raise ValueError(f"expected {nmark} markers but found {len(mesh['markers'])}")
+
+    return mesh
+
+
+# read all zones in parallel threads, the time is set by the largest zone instead of the sum of all zones.
+# the parsing (numpy) releases the GIL for most of the work. The zones are read from the same buffer,
+# and the lazy markers of every zone are read from the source of the mesh later on
+def _read_su2_zones(buf, source, zones, lazy_markers, progress):
+    # set when the reading failed or was cancelled, the zones that are being read stop after their current chunk
+    stop = threading.Event()
+
+    def check_stop(what, count, total):
+        if stop.is_set():
+            raise MeshLoadCancelled()
+
+    nworkers = max(1, min(len(zones), os.cpu_count() or 1))
+    with ThreadPoolExecutor(nworkers) as executor:
+        futures = [executor.submit(_read_su2_zone, buf, sections, lazy_markers, check_stop) for sections in zones]
+        try:
+            while True:
+                done, pending = wait(futures, timeout=0.25, return_when=FIRST_EXCEPTION)
+                if progress is not None:
+                    progress("zones", len(done), len(futures))
+                if not pending or any(f.exception() is not None for f in done):
+                    break
+            meshes = [f.result() for f in futures]
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    for mesh in meshes:
+        mesh["source"] = source
+    return meshes
+
+
+# read the elements of a marker section found by read_su2_mesh
+def read_su2_marker(buf, marker):
+    return parse_su2_elements(buf, marker["data"], marker["end"], marker["nelem"])
+
+
+# read a .su2 mesh file on the server, the file is memory-mapped and parsed chunk by chunk
+# so the file content is never held in memory as a whole
+def read_su2_mesh_file(filename, lazy_markers=False, progress=None):
+    source = {"path": os.path.abspath(filename)}
+    # the lazy markers are read from the file again, which should not have changed by then
+    with open_su2_mesh_source(source) as buf:
+        return _read_su2_mesh(buf, source, lazy_markers, progress)
+
+
+# buffer with the content of a mesh source: a file on the server (memory-mapped) or the content itself
+@contextmanager
+def open_su2_mesh_source(source):
+    if not isinstance(source, dict):
+        yield source
+        return
+
+    with open(source["path"], 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            raise ValueError(f"mesh file {source['path']} is empty")
+        if source.setdefault("size", stat.st_size) != stat.st_size or source.setdefault("mtime", stat.st_mtime_ns) != stat.st_mtime_ns:
+            raise ValueError(f"mesh file {source['path']} has changed since it was loaded")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
+
+
+# the state entry for a mesh file on the server: only the metadata, the loader reads the file from the path
+# that is kept on the server (see core/server_files.py)
+def su2_mesh_file_info(filename):
+    return server_file_info(filename)
+
+
+########################################################################################
+# ##### construct vtk objects from the numpy arrays
+########################################################################################
+def make_vtk_points(points):
+    pts = vtk.vtkPoints()
+    # no copy, vtk keeps a reference to the numpy array
+    pts.SetData(numpy_to_vtk(points, deep=False))
+    return pts
+
+
+# set the cells of an unstructured grid (offsets plus connectivity, mixed cell types)
+def set_vtk_cells(ugrid, cell_types, offsets, connectivity):
+    cells = vtkCellArray()
+    cells.SetData(numpy_to_vtkIdTypeArray(offsets), numpy_to_vtkIdTypeArray(connectivity))
+    ugrid.SetCells(numpy_to_vtk(cell_types, deep=True, array_type=VTK_UNSIGNED_CHAR), cells)
+
+
+########################################################################################
+# ##### markers as polydata with only the points of the marker
+########################################################################################
+# name of the point data array with the global point id (index in the points of the zone)
+# of every point of a marker
+GLOBAL_POINT_IDS = "GlobalPointIds"
+
+# name of the field data array with the index of the zone of a marker
+MARKER_ZONE = "Zone"
+
+
+def make_marker_polydata(points, cells, polydata=None):
+    """ surface polydata of a marker, with only the points that are used by the marker
+
+        points: (npoin, 3) array with the points of the zone
+        cells: dict with the cell_types, offsets and connectivity of the marker (global point ids)
+        the points are renumbered 0..n-1, the global point ids are stored as the global ids of the point data.
+        the marker elements are lines (2D) or triangles and quadrilaterals (3D). Note that a polydata
+        lists all its lines before its polygons, a marker with both would change the order of its elements
+    """
+    if polydata is None:
+        polydata = vtkPolyData()
+    cell_types = np.asarray(cells["cell_types"])
+    offsets = np.asarray(cells["offsets"])
+    global_ids, local_ids = np.unique(cells["connectivity"], return_inverse=True)
+
+    polydata.SetPoints(make_vtk_points(np.ascontiguousarray(points[global_ids])))
+    ids = numpy_to_vtkIdTypeArray(global_ids.astype(np.int64), deep=True)
+    ids.SetName(GLOBAL_POINT_IDS)
+    polydata.GetPointData().SetGlobalIds(ids)
+
+    sizes = np.diff(offsets)
+    is_line = cell_types == 3
+    for selected, set_cells in ((is_line, polydata.SetLines), (~is_line, polydata.SetPolys)):
+        if not selected.any():
+            continue
+        cellarray = vtkCellArray()
+        cellarray.SetData(numpy_to_vtkIdTypeArray(np.concatenate(([0], np.cumsum(sizes[selected]))).astype(np.int64), deep=True),
+                          numpy_to_vtkIdTypeArray(local_ids.reshape(-1)[np.repeat(selected, sizes)].astype(np.int64), deep=True))
+        set_cells(cellarray)
+    return polydata
+
+
+def set_marker_zone(polydata, izone):
+    zone = vtkIntArray()
+    zone.SetName(MARKER_ZONE)
+    zone.InsertNextValue(izone)
+    polydata.GetFieldData().AddArray(zone)
+
+
+# the cells of a marker polydata with the global point ids, in the same format as read_su2_marker
+def marker_polydata_cells(polydata):
+    if polydata.GetPointData().GetGlobalIds() is None:
+        raise ValueError("the cells of the marker have not been read")
+    global_ids = vtk_to_numpy(polydata.GetPointData().GetGlobalIds())
+    cell_types = []
+    offsets = [np.zeros(1, dtype=np.int64)]
+    connectivity = []
+    nconn = 0
+    for cellarray in (polydata.GetLines(), polydata.GetPolys()):
+        if cellarray.GetNumberOfCells() == 0:
+            continue
+        cell_offsets = vtk_to_numpy(cellarray.GetOffsetsArray()).astype(np.int64)
+        sizes = np.diff(cell_offsets)
+        # the su2 (vtk) element type follows from the number of nodes
+        cell_types.append(np.select([sizes == 2, sizes == 3, sizes == 4], [3, 5, 9], 7).astype(np.uint8))
+        offsets.append(cell_offsets[1:] + nconn)
+        connectivity.append(global_ids[vtk_to_numpy(cellarray.GetConnectivityArray())].astype(np.int64))
+        nconn += cell_offsets[-1]
+    return {"cell_types": np.concatenate([np.zeros(0, dtype=np.uint8)] + cell_types),
+            "offsets": np.concatenate(offsets),
+            "connectivity": np.concatenate([np.zeros(0, dtype=np.int64)] + connectivity)}
+
+
+########################################################################################
+# ##### read a case that was saved as a vtk xml multiblock file (.vtm)
+########################################################################################
+def read_vtm_mesh(filename, progress=None):
+    """ read the mesh and the point data of a case saved with save_vtm
+
+        returns a mesh in the same format as read_su2_mesh, the markers are read completely.
+        point_data: the vtk point data arrays of the (first) zone, e.g. the solution
+        mesh_file: the mesh file of the case that was recorded by save_vtm, or None
+    """
+    reader = vtkXMLMultiBlockDataReader()
+    reader.SetFileName(str(filename))
+    if progress is not None:
+        reader.AddObserver("ProgressEvent", lambda caller, event: progress("vtm", int(100 * caller.GetProgress()), 100))
+    reader.Update()
+    root = reader.GetOutput()
+    if root is None or root.GetNumberOfBlocks() < 2 or root.GetBlock(0) is None:
+        raise ValueError(f"{filename} is not a saved case, expected an interior and a boundary block")
+
+    interior, boundary = root.GetBlock(0), root.GetBlock(1)
+    zones = []
+    for izone in range(interior.GetNumberOfBlocks()):
+        ugrid = interior.GetBlock(izone)
+        cell_types = vtk_to_numpy(ugrid.GetCellTypesArray())
+        zones.append({"ndime": 3 if np.isin(cell_types, (10, 12, 13, 14)).any() else 2,
+                      "points": vtk_to_numpy(ugrid.GetPoints().GetData()),
+                      "cell_types": cell_types,
+                      "offsets": vtk_to_numpy(ugrid.GetCells().GetOffsetsArray()).astype(np.int64),
+                      "connectivity": vtk_to_numpy(ugrid.GetCells().GetConnectivityArray()).astype(np.int64),
+                      "markers": [],
+                      "source": None})
+    for i in range(boundary.GetNumberOfBlocks()):
+        polydata = boundary.GetBlock(i)
+        zone = polydata.GetFieldData().GetArray(MARKER_ZONE)
+        marker = marker_polydata_cells(polydata)
+        marker["tag"] = boundary.GetMetaData(i).Get(vtk.vtkCompositeDataSet.NAME())
+        marker["nelem"] = len(marker["cell_types"])
+        zones[zone.GetValue(0) if zone is not None else 0]["markers"].append(marker)
+
+    mesh = zones[0] if len(zones) == 1 else {"zones": zones}
+    pointdata = interior.GetBlock(0).GetPointData()
+    mesh["point_data"] = [pointdata.GetArray(i) for i in range(pointdata.GetNumberOfArrays())]
+    # the mesh file the case was saved from, see save_vtm()
+    mesh_file = root.GetFieldData().GetAbstractArray("MeshFile")
+    mesh["mesh_file"] = json.loads(mesh_file.GetValue(0)) if mesh_file is not None else None
+    return mesh
+
+
+########################################################################################
+# ##### lazy markers: the cells of a marker are only read when they are needed
+########################################################################################
+# marker polydata whose cells have not been read yet
+_lazy_markers = {}
+
+
+def _marker_key(polydata):
+    return polydata.GetAddressAsString('vtkObject')
+
+
+# empty polydata for a marker section that was not read yet, the points and cells
+# are added by load_lazy_marker()
+def make_lazy_marker(points, source, marker):
+    polydata = vtkPolyData()
+    _lazy_markers[_marker_key(polydata)] = (polydata, points, source, marker)
+    return polydata
+
+
+def is_lazy_marker(polydata):
+    return polydata is not None and _marker_key(polydata) in _lazy_markers
+
+
+# read the cells of a lazy marker, returns True if the cells were read now
+def load_lazy_marker(polydata):
+    if not is_lazy_marker(polydata):
+        return False
+    _, points, source, marker = _lazy_markers[_marker_key(polydata)]
+    cells = su2_marker_cells(source, marker)
+    # only when the cells were read, a marker that could not be read is tried again the next time
+    del _lazy_markers[_marker_key(polydata)]
+    make_marker_polydata(points, cells, polydata)
+    return True
+
+
+# the cells of a marker of a zone, read from the source of the zone if the marker is lazy.
+# The cells are kept with the marker, so the mesh report, the mesh cache and the
+# boundary that is shown all use the same cells and a marker is only read once
+def su2_marker_cells(source, marker):
+    if "connectivity" not in marker:
+        if "first" in marker:
+            # marker of a cached mesh
+            cells = read_cached_su2_marker(source, marker)
+        else:
+            with open_su2_mesh_source(source) as buf:
+                cells = read_su2_marker(buf, marker)
+        marker.update(cells)
+    return marker
+
+
+# read all lazy markers in a multiblock (e.g. before exporting the mesh)
+def load_lazy_markers(multiblock):
+    for i in range(multiblock.GetNumberOfBlocks()):
+        load_lazy_marker(multiblock.GetBlock(i))
+
+
+# forget the lazy markers of the previous mesh
+def clear_lazy_markers():
+    _lazy_markers.clear()
+
+
+########################################################################################
+# ##### binary cache of parsed meshes
+########################################################################################
+# every parsed mesh is stored in the case directory as a set of .npy files plus a small json header,
+# in a subdirectory named after the cache key. The next time the same file is loaded,
+# the arrays are memory-mapped and the text is not parsed again.
+MESH_CACHE_DIR = ".mesh_cache"
+MESH_CACHE_VERSION = 3
+
+_MESH_CACHE_ARRAYS = ("points", "cell_types", "offsets", "connectivity",
+                      "marker_elems", "marker_cell_types", "marker_offsets", "marker_connectivity")
+
+# unfinished cache entries are written in directories with this prefix
+_MESH_CACHE_TMP = ".tmp-"
+
+
+# the cache key of a mesh: hash of the file content plus its modification time
+def su2_mesh_cache_key(buf, mtime, progress=None):
+    return f"{su2_mesh_hash(buf, progress)}-{mtime}"
+
+
+# hash of the content of a mesh, progress(what, count, total) is called after every chunk
+def su2_mesh_hash(buf, progress=None):
+    h = hashlib.blake2b(digest_size=16)
+    for start in range(0, len(buf), CHUNK_SIZE):
+        h.update(buf[start:start + CHUNK_SIZE])
+        if progress is not None:
+            progress("hash", min(start + CHUNK_SIZE, len(buf)), len(buf))
+    return h.hexdigest()
+
+
+# write the parsed mesh to the cache, the elements of lazy markers are read now
+def write_su2_mesh_cache(cache_dir, name, key, mesh):
+    zones = [_su2_zone_cache_arrays(zone) for zone in su2_mesh_zones(mesh)]
+    header = {"version": MESH_CACHE_VERSION,
+              "name": name,
+              "key": key,
+              "zones": [{"ndime": zone["ndime"], "markers": [m["tag"] for m in zone["markers"]]}
+                        for zone in su2_mesh_zones(mesh)]}
+    # the mesh report, when it was already made
+    if mesh.get("report") is not None:
+        header["report"] = mesh["report"]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # write everything in a temporary directory first, so a cache entry is either complete or absent
+    tmp = tempfile.mkdtemp(prefix=_MESH_CACHE_TMP, dir=cache_dir)
+    try:
+        # every zone in its own subdirectory
+        for izone, arrays in enumerate(zones):
+            os.mkdir(os.path.join(tmp, f"zone_{izone}"))
+            for array in _MESH_CACHE_ARRAYS:
+                np.save(os.path.join(tmp, f"zone_{izone}", array + ".npy"), np.ascontiguousarray(arrays[array]))
+        with open(os.path.join(tmp, "header.json"), 'w') as f:
+            json.dump(header, f)
+        os.replace(tmp, os.path.join(cache_dir, key))
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # another reader already wrote the same entry
+        if not os.path.isdir(os.path.join(cache_dir, key)):
+            raise
+    clean_su2_mesh_cache(cache_dir, name, key)
+
+
+# the arrays of a zone that are stored in the cache, the elements of lazy markers are read now
+def _su2_zone_cache_arrays(zone):
+    markers = [su2_marker_cells(zone["source"], marker) for marker in zone["markers"]]
+
+    # all markers in one set of arrays, marker_elems is the index of the first element of every marker
+    nelems = [len(m["cell_types"]) for m in markers]
+    nconn = np.cumsum([0] + [len(m["connectivity"]) for m in markers])
+    return {"points": zone["points"],
+            "cell_types": zone["cell_types"],
+            "offsets": zone["offsets"],
+            "connectivity": zone["connectivity"],
+            "marker_elems": np.cumsum([0] + nelems, dtype=np.int64),
+            "marker_cell_types": np.concatenate([np.zeros(0, dtype=np.uint8)] + [m["cell_types"] for m in markers]),
+            "marker_offsets": np.concatenate([m["offsets"][:-1] + nconn[i] for i, m in enumerate(markers)]
+                                             + [nconn[-1:]]).astype(np.int64),
+            "marker_connectivity": np.concatenate([np.zeros(0, dtype=np.int64)] + [m["connectivity"] for m in markers])}
+
+
+# memory-map the cached mesh with this key, returns None if there is no (valid) cache entry
+def read_su2_mesh_cache(cache_dir, key):
+    path = os.path.join(cache_dir, key)
+    zones = []
+    try:
+        with open(os.path.join(path, "header.json")) as f:
+            header = json.load(f)
+        if header.get("version") != MESH_CACHE_VERSION or header.get("key") != key:
+            return None
+        for izone, zone in enumerate(header["zones"]):
+            # copy-on-write, vtk gets a pointer to the data and the cache files are never modified
+            arrays = {array: np.load(os.path.join(path, f"zone_{izone}", array + ".npy"), mmap_mode='c')
+                      for array in _MESH_CACHE_ARRAYS}
+            marker_elems = arrays["marker_elems"]
+            if len(marker_elems) != len(zone["markers"]) + 1:
+                return None
+            zones.append({"ndime": zone["ndime"],
+                          "points": arrays["points"],
+                          "cell_types": arrays["cell_types"],
+                          "offsets": arrays["offsets"],
+                          "connectivity": arrays["connectivity"],
+                          # the markers are sliced out of the cached arrays when they are needed
+                          "markers": [{"tag": tag, "nelem": int(marker_elems[i+1] - marker_elems[i]),
+                                       "first": int(marker_elems[i])}
+                                      for i, tag in enumerate(zone["markers"])],
+                          "source": arrays})
+    except (OSError, ValueError, KeyError):
+        return None
+
+    mesh = zones[0] if len(zones) == 1 else {"zones": zones}
+    mesh["cached"] = True
+    if header.get("report") is not None:
+        mesh["report"] = header["report"]
+    return mesh
+
+
+# the elements of a marker of a cached mesh
+def read_cached_su2_marker(arrays, marker):
+    first = marker["first"]
+    offsets = arrays["marker_offsets"][first:first + marker["nelem"] + 1]
+    return {"cell_types": arrays["marker_cell_types"][first:first + marker["nelem"]],
+            "offsets": offsets - offsets[0],
+            "connectivity": arrays["marker_connectivity"][offsets[0]:offsets[-1]]}
+
+
+# remove the cache entries that are not valid anymore: older versions of the mesh file 'name',
+# entries written by another version of the cache and unfinished entries that were left behind
+def clean_su2_mesh_cache(cache_dir, name, key):
+    if not os.path.isdir(cache_dir):
+        return
+    for entry in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, entry)
+        if entry == key:
+            continue
+        if entry.startswith(_MESH_CACHE_TMP):
+            # might still be written by another thread
+            stale = time.time() - os.path.getmtime(path) > 3600
+        else:
+            try:
+                with open(os.path.join(path, "header.json")) as f:
+                    header = json.load(f)
+                stale = header.get("version") != MESH_CACHE_VERSION or header.get("name") == name
+            except (OSError, ValueError):
+                stale = True
+        if stale:
+            shutil.rmtree(path, ignore_errors=True)
@@ -4,16 +4,18 @@ The SU2 Graphical User Interface.
 
 import os
 import argparse
+import asyncio
+import threading
 from base64 import b64encode
 
-from trame.app import get_server
+from trame.app import get_server, asynchronous
 from trame.app.file_upload import ClientFile
 from trame.widgets import markdown
 
 from trame.ui.vuetify import SinglePageWithDrawerLayout
 #from trame.ui.vuetify import SinglePageLayout
 from trame.widgets import vuetify, vtk as vtk_widgets
-from trame.widgets import trame
+from trame.widgets import trame, html
 
 #import itertools
 from datetime import date
@@ -21,7 +23,16 @@ from datetime import date
 # Import json setup for writing the config file in json and cfg file format.
 from core.su2_json import *
 # Export su2 mesh file.
-from core.su2_io import save_su2mesh, save_json_cfg_file
+from core.su2_io import save_su2mesh, save_json_cfg_file, set_mesh_origin, save_vtm, vtm_mesh_origin, CASE_VTM_FILENAME
+# Read su2 mesh file.
+from core.su2_mesh import read_su2_mesh, read_su2_mesh_file, su2_mesh_file_info, make_vtk_points, set_vtk_cells
+from core.su2_mesh import su2_mesh_zones, make_marker_polydata, make_lazy_marker, load_lazy_marker, clear_lazy_markers, MeshLoadCancelled
+from core.su2_mesh import open_su2_mesh_source, su2_mesh_cache_key, read_su2_mesh_cache, write_su2_mesh_cache
+from core.su2_mesh import clean_su2_mesh_cache, MESH_CACHE_DIR, read_vtm_mesh, set_marker_zone
+from core.server_files import server_file_path
+from core.mesh_quality import su2_mesh_report, format_su2_mesh_report
+from core.case_cache import case_cache_get, case_cache_put, set_case_cache_budget, CASE_CACHE_BUDGET
+from core.restart_snapshots import set_restart_snapshot_budget, RESTART_SNAPSHOT_BUDGET
 #
 from ui.vtk_helper import *
 # 
@@ -53,23 +64,13 @@ from vtkmodules.vtkInteractionWidgets import vtkOrientationMarkerWidget, vtkScal
 from vtkmodules.vtkRenderingCore import (
     vtkActor,
     vtkDataSetMapper,
+    vtkPolyDataMapper,
     vtkRenderer,
     vtkRenderWindow,
     vtkRenderWindowInteractor,
 )
 
-from vtkmodules.vtkCommonDataModel import (
-    VTK_HEXAHEDRON,
-    VTK_LINE,
-    VTK_POLYGON,
-    VTK_QUAD,
-    VTK_TETRA,
-    VTK_TRIANGLE,
-    VTK_PYRAMID,
-    VTK_WEDGE,
-    VTK_TRIANGLE_STRIP,
-    VTK_VERTEX,
-    vtkUnstructuredGrid)
+from vtkmodules.vtkCommonDataModel import vtkUnstructuredGrid
 
 # Required for interactor initialization
 from vtkmodules.vtkInteractionStyle import vtkInteractorStyleSwitch  # noqa
@@ -156,6 +157,10 @@ state.show_dialog = False
 # TODO FIXME update from user input / cfg file
 state.history_filename = 'history.csv'
 state.fileio_restart_filename = 'restart'
+# fields of the restart file that are read on every refresh during a run, next to the field that is shown
+state.restart_pinned_fields = []
+# the iterations of the restart snapshots of the run (see core/restart_snapshots.py)
+state.restart_snapshot_iterations = []
 
 state.monitorLinesVisibility = []
 state.monitorLinesNames = []
@@ -236,6 +241,114 @@ renderer.AddActor(mesh_actor)
 
 
 
+# read the cells of a boundary marker, if they were not read yet
+def load_marker(polydata):
+    try:
+        if load_lazy_marker(polydata):
+            log("info", f"read marker with {polydata.GetNumberOfCells()} cells")
+    except (ValueError, OSError) as e:
+        log("error", f"Could not read the boundary marker from the mesh file:  \n {e}")
+
+# markers are read when they are rendered for the first time
+def load_visible_markers(caller, event):
+    for actor in mesh_actor_list:
+        if actor['mesh'].GetVisibility():
+            load_marker(actor['mesh'].GetMapper().GetInput())
+
+renderer.AddObserver("StartEvent", load_visible_markers)
+
+
+#######################################################
+# ##### level of detail for large 3D meshes ##### #
+#######################################################
+# while the camera is moving, the boundaries are drawn as decimated surfaces without edges
+# when the visible boundaries have more faces than this threshold
+state.lod_face_threshold = 1000000
+
+# decimated mappers per boundary actor: actor address -> mapper
+lod_mappers = {}
+# the full resolution mapper and edge visibility of the actors that are drawn decimated right now
+lod_actors = []
+# boundary actors whose decimated surface is being made, and the mesh they belong to
+# (generation changes with every new mesh, so surfaces of an old mesh are dropped)
+lod_jobs = {"pending": set(), "generation": 0}
+
+def lod_face_threshold():
+    try:
+        return max(int(state.lod_face_threshold), 1)
+    except (TypeError, ValueError):
+        return 1000000
+
+# the boundary actors that are drawn decimated when the camera moves
+def lod_boundary_actors():
+    return [item['mesh'] for item in mesh_actor_list if item['name'] != 'internal']
+
+# make the decimated surfaces of the boundaries in the background, the surfaces are ready before the camera moves.
+# every boundary gets its share of the total number of faces of all boundaries
+def schedule_lod_mappers():
+    if state.nDim != 3:
+        return
+    actors = lod_boundary_actors()
+    faces = [actor.GetMapper().GetInput().GetNumberOfCells() for actor in actors]
+    threshold = lod_face_threshold()
+    if sum(faces) <= threshold:
+        return
+    jobs = []
+    for actor, nfaces in zip(actors, faces):
+        key = actor.GetAddressAsString('vtkObject')
+        # the cells of lazy markers are only known when the marker was read
+        if nfaces == 0 or key in lod_mappers or key in lod_jobs["pending"]:
+            continue
+        lod_jobs["pending"].add(key)
+        jobs.append((key, actor, threshold * nfaces / sum(faces)))
+    if jobs:
+        make_lod_mappers(jobs, lod_jobs["generation"])
+
+@asynchronous.task
+async def make_lod_mappers(jobs, generation):
+    for key, actor, target in jobs:
+        # the filters run in a worker thread on a shallow copy of the surface
+        surface = vtk.vtkPolyData()
+        surface.ShallowCopy(actor.GetMapper().GetInput())
+        try:
+            decimated = await asyncio.get_event_loop().run_in_executor(None, MakeDecimatedPolyData, surface, target)
+        finally:
+            lod_jobs["pending"].discard(key)
+        if generation != lod_jobs["generation"]:
+            return
+        mapper = vtkPolyDataMapper()
+        mapper.ScalarVisibilityOff()
+        mapper.SetInputData(decimated)
+        lod_mappers[key] = mapper
+
+def start_lod(caller, event):
+    if state.nDim != 3 or lod_actors:
+        return
+    actors = [actor for actor in lod_boundary_actors() if actor.GetVisibility()]
+    faces = [actor.GetMapper().GetInput().GetNumberOfCells() for actor in actors]
+    if sum(faces) <= lod_face_threshold():
+        return
+    for actor in actors:
+        mapper = lod_mappers.get(actor.GetAddressAsString('vtkObject'))
+        # the boundaries that do not have a decimated surface yet are drawn with full resolution
+        if mapper is None:
+            continue
+        lod_actors.append((actor, actor.GetMapper(), actor.GetProperty().GetEdgeVisibility()))
+        actor.SetMapper(mapper)
+        actor.GetProperty().EdgeVisibilityOff()
+    schedule_lod_mappers()
+
+# full resolution again when the camera stops
+def end_lod(caller, event):
+    for actor, mapper, edges in lod_actors:
+        actor.SetMapper(mapper)
+        actor.GetProperty().SetEdgeVisibility(edges)
+    del lod_actors[:]
+
+renderWindowInteractor.GetInteractorStyle().GetCurrentStyle().AddObserver("StartInteractionEvent", start_lod)
+renderWindowInteractor.GetInteractorStyle().GetCurrentStyle().AddObserver("EndInteractionEvent", end_lod)
+
+
 ###################################
 # ##### gradient background ##### #
 ###################################
@@ -419,6 +532,8 @@ def actives_change(ids):
     log("info", f"mesh_actor_list =  = {mesh_actor_list}")
     if not selectedBoundary==None:
       state.selectedBoundaryName = selectedBoundary["name"]
+      # make sure the cells of the selected marker are available
+      load_marker(selectedBoundary["mesh"].GetMapper().GetInput())
     else:
       # for 2D, show internal as default when we have not selected anything
       if state.nDim == 2:
@@ -520,6 +635,8 @@ def actives_change(ids):
 
 # improvements required
 def resetCamera():
+    # the bounds of the markers are only known after they are read
+    load_visible_markers(None, None)
     renderer.ResetCamera()
     ctrl.view_update()
 
@@ -543,13 +660,32 @@ def save_file_su2(su2_filename):
     global root
     save_su2mesh(root,su2_filename)
 
+# export the mesh and the solution as a vtk xml multiblock file (save on the server)
+@ctrl.trigger("save_case_vtm")
+def save_case_vtm():
+    log("info", "********** save .vtm **********\n")
+    save_vtm(root, CASE_VTM_FILENAME)
+
+# pin the field that is shown, so it is also read on every refresh of the restart during a run
+@ctrl.trigger("toggle_restart_pin")
+def toggle_restart_pin():
+    if state.mesh_color_array_idx >= len(state.dataset_arrays):
+        return
+    array = state.dataset_arrays[state.mesh_color_array_idx]
+    name = array.get("array", array.get("text"))
+    if name in state.restart_pinned_fields:
+        state.restart_pinned_fields = [field for field in state.restart_pinned_fields if field != name]
+    else:
+        state.restart_pinned_fields = state.restart_pinned_fields + [name]
+    log("info", f"pinned restart fields = {state.restart_pinned_fields}")
+
 # Color By Callbacks
 def color_by_array(actor, array):
     log("info", "change color by array")
 
     _min, _max = array.get("range")
     mesh_mapper = actor.GetMapper()
-    mesh_mapper.SelectColorArray(array.get("text"))
+    mesh_mapper.SelectColorArray(array.get("array", array.get("text")))
     mesh_mapper.GetLookupTable().SetRange(_min, _max)
 
     if array.get("type") == vtkDataObject.FIELD_ASSOCIATION_POINTS:
@@ -561,6 +697,7 @@ def color_by_array(actor, array):
 
     lut = get_diverging_lut()
     lut.SetTableRange(_min,_max)
+    set_lut_component(lut, array)
     mesh_mapper.SetLookupTable(lut)
     mesh_mapper.GetLookupTable().SetRange(_min, _max)
     actor.SetMapper(mesh_mapper)
@@ -580,6 +717,11 @@ def update_mesh_color_by_name(mesh_color_array_idx, **kwargs):
     else:
         array =  {'text': 'Solid', 'value': 0, 'range': [1.0, 1.0], 'type': 0}
 
+    # fields that were left out of the live refresh of the restart are read now
+    array = load_restart_field(array)
+    if array is None:
+        return
+
     if state.nDim == 2:
       # color the internal
       #color_by_array(mesh_actor, array)
@@ -713,17 +855,25 @@ state.LMaterialsHeatCapacity = LMaterialsHeatCapacityConst
 # FILES
 ###############################################################
 
+# the mesh that is currently being read in the background
+mesh_load_job = None
+state.mesh_loading = False
+state.mesh_load_progress = 0
+state.mesh_load_text = ""
+
 # load SU2 .su2 mesh file #
 # currently loads a 2D or 3D .su2 file
+# the file is read in a worker thread, the current mesh stays visible until the new mesh is read
 @state.change("su2_file_upload")
 def load_file_su2(su2_file_upload, **kwargs):
-    global pipeline
-    # remove the added boundary conditions in the pipeline
-    pipeline.remove_right_subnode("Boundaries")
-
-    del mesh_actor_list[:]
+    global mesh_load_job
+    # a new file replaces the one that is currently being read
+    cancel_mesh_load()
 
     if su2_file_upload is None:
+        # remove the added boundary conditions in the pipeline
+        pipeline.remove_right_subnode("Boundaries")
+        del mesh_actor_list[:]
         return
 
     # check if the case name is set
@@ -736,6 +886,175 @@ def load_file_su2(su2_file_upload, **kwargs):
     # log("info", f"size =  = {su2_file_upload.get("size"}"))
     # log("info", f"type =  = {su2_file_upload.get("type"}"))
 
+    mesh_load_job = {"name": su2_file_upload.get("name"),
+                     "progress": 0,
+                     "text": "",
+                     "cancel": threading.Event(),
+                     # the parsed mesh is cached in the case directory
+                     "cache_dir": str(BASE / "user" / state.case_name / MESH_CACHE_DIR),
+                     "cache_key": None,
+                     # the mesh file of a saved case, see vtm_mesh_origin()
+                     "origin": None}
+    load_file_su2_task(su2_file_upload, mesh_load_job)
+
+
+# stop reading the mesh in the background, the current mesh is kept
+def cancel_mesh_load():
+    if mesh_load_job is not None:
+        mesh_load_job["cancel"].set()
+
+
+# read the mesh file into numpy arrays, this runs in a worker thread
+def read_mesh_job(su2_file_upload, job):
+
+    # called by the mesh reader after every chunk
+    def progress(what, count, total):
+        if job["cancel"].is_set():
+            raise MeshLoadCancelled()
+        job["progress"] = int(100 * count / max(total, 1))
+        job["text"] = f"{what}: {count} / {total}"
+
+    # a file on the server, only the files that the server registered itself (see core/server_files.py)
+    path = server_file_path(su2_file_upload)
+
+    # a saved case is a binary file, it is not parsed and not cached.
+    # The mesh file it was saved from is the origin of the mesh when it did not change
+    if path and path.endswith(".vtm"):
+        mesh = case_cache_get("mesh", path) or read_vtm_mesh(path, progress=progress)
+        job["origin"] = vtm_mesh_origin(path, mesh.get("mesh_file"))
+        return mesh
+
+    # a recently opened mesh file that did not change is still in memory
+    if path:
+        mesh = case_cache_get("mesh", path)
+        if mesh is not None:
+            return mesh
+
+    # the cache key is the hash of the content plus the modification time of the file
+    if path:
+        source = {"path": path}
+        with open_su2_mesh_source(source) as buf:
+            job["cache_key"] = su2_mesh_cache_key(buf, source["mtime"], progress)
+    else:
+        content = ClientFile(su2_file_upload).content
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        job["cache_key"] = su2_mesh_cache_key(content, su2_file_upload.get("lastModified"), progress)
+
+    clean_su2_mesh_cache(job["cache_dir"], job["name"], job["cache_key"])
+    mesh = read_su2_mesh_cache(job["cache_dir"], job["cache_key"])
+    if mesh is not None:
+        log("info", f"Mesh {job['name']} read from the cache")
+        return mesh
+
+    # mesh file format specific
+    # the elements of the markers are only read when the marker is needed
+    if path:
+        # server side file, read directly from disk
+        return read_su2_mesh_file(path, lazy_markers=True, progress=progress)
+    else:
+        # uploaded file, parse the received content without decoding it first
+        return read_su2_mesh(content, lazy_markers=True, progress=progress)
+
+
+# the file the mesh was read from, see set_mesh_origin()
+def mesh_origin(su2_file_upload, job):
+    path = server_file_path(su2_file_upload)
+    if path and path.endswith(".vtm"):
+        return job.get("origin")
+    digest = job["cache_key"].split("-")[0] if job["cache_key"] else None
+    if path:
+        return {"path": path, "hash": digest}
+    content = ClientFile(su2_file_upload).content
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return {"content": content, "hash": digest}
+
+
+@asynchronous.task
+async def load_file_su2_task(su2_file_upload, job):
+    with state:
+        state.mesh_loading = True
+        state.mesh_load_progress = 0
+        state.mesh_load_text = f"reading {job['name']}"
+
+    future = asyncio.get_event_loop().run_in_executor(None, read_mesh_job, su2_file_upload, job)
+    # publish the progress while the mesh is being read
+    while not future.done():
+        await asyncio.wait([future], timeout=0.25)
+        if job is mesh_load_job:
+            with state:
+                state.mesh_load_progress = job["progress"]
+                state.mesh_load_text = job["text"]
+
+    try:
+        mesh = future.result()
+    except MeshLoadCancelled:
+        log("info", f"Loading of mesh file {job['name']} was cancelled")
+        mesh = None
+    except (ValueError, OSError) as e:
+        log("error", f"Could not read the su2 mesh file {job['name']}:  \n {e}")
+        mesh = None
+
+    # only the last requested mesh is shown
+    if job is not mesh_load_job:
+        return
+    with state:
+        state.mesh_loading = False
+        if mesh is not None:
+            # swap the new mesh into the renderer in one go
+            set_mesh(mesh)
+            # as long as the mesh is not changed, the solver can use the original file
+            set_mesh_origin(mesh_origin(su2_file_upload, job))
+            # the solution of a saved case
+            if mesh.get("point_data"):
+                show_restart(point_data_restart(mesh["point_data"]), True)
+        elif state.restartFile is not None:
+            # a restart file that was chosen while the mesh was loading, for the current mesh
+            state.dirty('restartFile')
+
+    # keep the mesh in memory for switching back to this case
+    if mesh is not None and server_file_path(su2_file_upload):
+        case_cache_put("mesh", server_file_path(su2_file_upload), mesh)
+
+    # mesh statistics and quality report, it is kept with the mesh in memory and in the cache
+    if mesh is not None and mesh.get("report") is None:
+        def progress(what, count, total):
+            if job["cancel"].is_set():
+                raise MeshLoadCancelled()
+        try:
+            mesh["report"] = await asyncio.get_event_loop().run_in_executor(None, su2_mesh_report, mesh, progress)
+        except MeshLoadCancelled:
+            log("info", f"Report of mesh file {job['name']} was cancelled")
+        except (ValueError, OSError) as e:
+            log("warn", f"Could not make the report of mesh file {job['name']}:  \n {e}")
+        if job is mesh_load_job:
+            with state:
+                state.meshText = (format_su2_mesh_report(mesh["report"]) if mesh.get("report") is not None
+                                  else "no mesh report")
+
+    # the decimated boundaries for moving the camera, also made in the background after loading
+    if mesh is not None and job is mesh_load_job:
+        schedule_lod_mappers()
+
+    # store the parsed mesh for the next time the same file is loaded
+    if mesh is not None and not mesh.get("cached") and job["cache_key"] is not None:
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, write_su2_mesh_cache, job["cache_dir"],
+                                                           job["name"], job["cache_key"], mesh)
+            mesh["cached"] = True
+        except (ValueError, OSError) as e:
+            log("warn", f"Could not write the cache of mesh file {job['name']}:  \n {e}")
+
+
+# replace the current mesh by the mesh that was read
+def set_mesh(mesh):
+    global pipeline
+    # remove the added boundary conditions in the pipeline
+    pipeline.remove_right_subnode("Boundaries")
+
+    del mesh_actor_list[:]
+
     # remove all actors
     renderer.RemoveAllViewProps()
     grid.Reset()
@@ -750,108 +1069,69 @@ def load_file_su2(su2_file_upload, **kwargs):
     root.GetMetaData(0).Set(vtk.vtkCompositeDataSet.NAME(), 'Interior')
     root.SetBlock(1, branch_boundary)
     root.GetMetaData(1).Set(vtk.vtkCompositeDataSet.NAME(), 'Boundary')
-    pts = vtk.vtkPoints()
     # ### ### #
 
-    # mesh file format specific
-    file = ClientFile(su2_file_upload)
-    try:
-        filecontent = file.content.decode('utf-8')
-    except:
-        filecontent = file.content
+    # the marker sections of the previous mesh are not needed anymore
+    clear_lazy_markers()
+    lod_mappers.clear()
+    lod_jobs["pending"].clear()
+    lod_jobs["generation"] += 1
 
-    f = filecontent.splitlines()
+    # a multi-zone mesh has one interior block per zone
+    zones = su2_mesh_zones(mesh)
 
-    index = [idx for idx, s in enumerate(f) if 'NDIME' in s][0]
-    NDIME = int(f[index].split('=')[1])
+    NDIME = zones[0]["ndime"]
     # number of dimensions of the su2 mesh (2D or 3D)
     state.nDim = NDIME
-    # for the mesh info display
-    #state.meshText += "Mesh Dimensions: " + str(NDIME) + "D \n"
-
-    index = [idx for idx, s in enumerate(f) if 'NPOIN' in s][0]
-    numPoints = int((f[index].split('=')[1]).split()[0])
-    #state.meshText += "Number of points: " + str(numPoints) + "\n"
-
-    # get all the points
-    for point in range(numPoints):
-           x = float()
-           y = float()
-           z = float()
-           line = f[index+point+1].split()
-           x = float(line[0])
-           y = float(line[1])
-
-           if (NDIME==2):
-             # 2D is always x-y plane (z=0)
-             z = float(0.0)
-           else:
-             z = float(line[2])
-           pts.InsertNextPoint(x,y,z)
-
-    grid.SetPoints(pts)
+
+    numPoints = sum(len(zone["points"]) for zone in zones)
 
     # get the number of elements/cells
-    index = [idx for idx, s in enumerate(f) if 'NELEM' in s][0]
-    numCells = int(f[index].split('=')[1])
+    numCells = sum(len(zone["cell_types"]) for zone in zones)
     state.mesh= ["Number of cells: " + str(numCells) + "\n"]
 
-    for cell in range(numCells):
-            data = f[index+cell+1].split()
-            CellType = int(data[0])
-            # quadrilaterals
-            if(CellType==9):
-              quaddata = [int(data[1]),int(data[2]),int(data[3]),int(data[4])]
-              grid.InsertNextCell(VTK_QUAD,4,quaddata)
-            # triangles
-            elif(CellType==5):
-              tridata = [int(data[1]),int(data[2]),int(data[3])]
-              grid.InsertNextCell(VTK_TRIANGLE,3,tridata)
-            # hexahedral
-            elif(CellType==12):
-              hexdata = [int(data[1]),int(data[2]),int(data[3]),int(data[4]),int(data[5]),int(data[6]),int(data[7]),int(data[8])]
-              grid.InsertNextCell(VTK_HEXAHEDRON,8,hexdata)
-            # tetrahedral (4 faces)
-            elif(CellType==10):
-              tetdata = [int(data[1]),int(data[2]),int(data[3]),int(data[4])]
-              grid.InsertNextCell(VTK_TETRA,4,tetdata)
-            # wedge
-            elif(CellType==13):
-              wedgedata = [int(data[1]),int(data[2]),int(data[3]),int(data[4]),int(data[5]),int(data[6])]
-              grid.InsertNextCell(VTK_WEDGE,6,wedgedata)
-            # pyramid
-            elif(CellType==14):
-              pyramiddata = [int(data[1]),int(data[2]),int(data[3]),int(data[4]),int(data[5])]
-              grid.InsertNextCell(VTK_PYRAMID,5,pyramiddata)
-            else:
-              log("Error", f"cell type not suppported")
-
-
-    branch_interior.SetBlock(0, grid)
-    branch_interior.GetMetaData(0).Set(vtk.vtkCompositeDataSet.NAME(), 'Fluid-Zone-1')
+    # for the mesh info display, the quality report is made in the background after loading
+    if mesh.get("report") is not None:
+        state.meshText = format_su2_mesh_report(mesh["report"])
+    else:
+        state.meshText = ("Mesh dimensions: " + str(NDIME) + "D\n"
+                          + "Number of points: " + str(numPoints) + "\n"
+                          + "Number of cells: " + str(numCells) + "\n"
+                          + "computing the mesh report ...")
+
+    zone_grids = []
+    for izone, zone in enumerate(zones):
+        # the first zone is the global grid, the other zones get a grid of their own
+        zonegrid = grid if izone == 0 else vtkUnstructuredGrid()
+        zonegrid.SetPoints(make_vtk_points(zone["points"]))
+        set_vtk_cells(zonegrid, zone["cell_types"], zone["offsets"], zone["connectivity"])
+
+        branch_interior.SetBlock(izone, zonegrid)
+        branch_interior.GetMetaData(izone).Set(vtk.vtkCompositeDataSet.NAME(), 'Fluid-Zone-' + str(izone + 1))
+        zone_grids.append(zonegrid)
     del branch_interior
 
     # ### read the markers ### #
     boundaryNames = []
 
     markerNames=[]
-    index = [idx for idx, s in enumerate(f) if 'NMARK' in s][0]
-    numMarkers = int(f[index].split('=')[1])
+    zone_markers = [(izone, marker) for izone, zone in enumerate(zones) for marker in zone["markers"]]
+    numMarkers = len(zone_markers)
 
     global markergrid
-    markergrid = [vtkUnstructuredGrid() for i in range(numMarkers)]
-
-    # now loop over the markers
-    counter=0
-    for iMarker in range(numMarkers):
-          # grid for the marker
-          #markergrid = vtkUnstructuredGrid()
-          # copy all the points into the markergrid (inefficient)
-          markergrid[iMarker].SetPoints(pts)
-          # next line: marker tag, marker_elem
-          counter += 1
+    markergrid = []
+
+    # now loop over the markers of all zones
+    for iMarker, (izone, marker) in enumerate(zone_markers):
+          # surface polydata for the marker, with only the points of the zone that the marker uses
+          # the cells are read when the marker is rendered, selected or exported
+          if "connectivity" in marker:
+              markergrid.append(make_marker_polydata(zones[izone]["points"], marker))
+          else:
+              markergrid.append(make_lazy_marker(zones[izone]["points"], zones[izone]["source"], marker))
+          set_marker_zone(markergrid[iMarker], izone)
           # this is the name (string) of the boundary
-          markertag = f[index+counter].split("=")[1].strip()
+          markertag = marker["tag"]
 
           # add name to the boundaryNames list of dicts
           boundaryNames.append(
@@ -861,46 +1141,18 @@ def load_file_su2(su2_file_upload, **kwargs):
             }
           )
           markerNames.append(markertag)
-          # next line: marker tag, marker_elem
-          counter+=1
-          line = f[index+counter].split("=")
-          numCells = int(line[1])
-          #log("info", f"number of cells =  = {numCells}")
-
-          # loop over all cells
-          for cell in range(numCells):
-            counter+=1
-            data = f[index+counter].split()
-            #log("info", f"data =  = {data}")
-            CellType = int(data[0])
-            # line
-            if(CellType==3):
-              linedata = [int(data[1]),int(data[2])]
-              markergrid[iMarker].InsertNextCell(VTK_LINE,2,linedata)
-            # triangles
-            elif(CellType==5):
-              tridata = [int(data[1]),int(data[2]),int(data[3])]
-              markergrid[iMarker].InsertNextCell(VTK_TRIANGLE,3,tridata)
-            # quadrilaterals
-            elif(CellType==9):
-              quaddata = [int(data[1]),int(data[2]),int(data[3]),int(data[4])]
-              markergrid[iMarker].InsertNextCell(VTK_QUAD,4,quaddata)
-            else:
-              log("Error", f"marker cell type not suppported")
           # put boundary in multiblock structure
           branch_boundary.SetBlock(iMarker, markergrid[iMarker])
           branch_boundary.GetMetaData(iMarker).Set(vtk.vtkCompositeDataSet.NAME(), markertag)
 
 
-    # end loop over lines
-
     #del markergrid
     #del pts
 
-    # boundary meshes as unstructured grids
+    # boundary meshes as polydata
     ds_b = []
     for i in range(branch_boundary.GetNumberOfBlocks()):
-        ds_b.append(vtk.vtkUnstructuredGrid.SafeDownCast(branch_boundary.GetBlock(i)))
+        ds_b.append(vtk.vtkPolyData.SafeDownCast(branch_boundary.GetBlock(i)))
     del branch_boundary
 
     # we also clear the arrays, if any
@@ -931,13 +1183,26 @@ def load_file_su2(su2_file_upload, **kwargs):
 
     renderer.AddActor(mesh_actor)
 
+    # the other zones of a multi-zone mesh, shown like the first zone
+    for izone in range(1, len(zone_grids)):
+        zone_mapper = vtkDataSetMapper()
+        zone_mapper.ScalarVisibilityOff()
+        zone_mapper.SetInputData(zone_grids[izone])
+        zone_actor = vtkActor()
+        zone_actor.SetMapper(zone_mapper)
+        zone_actor.SetVisibility(NDIME==2)
+        zone_actor.GetProperty().EdgeVisibilityOn()
+        zone_actor.GetProperty().SetColor(colors.GetColor3d('floralwhite'))
+        zone_actor.SetObjectName('Fluid-Zone-' + str(izone + 1))
+        renderer.AddActor(zone_actor)
+
     # boundary actors
     boundary_id = 101
     i = 0
     log("info", f"length of ds_b= = {len(ds_b)}")
     for bcName in boundaryNames:
         log("info", f"bc name= = {bcName}")
-        mesh_mapper_b1 = vtkDataSetMapper()
+        mesh_mapper_b1 = vtkPolyDataMapper()
         mesh_mapper_b1.ScalarVisibilityOff()
         mesh_actor_b1 = vtkActor()
         # in 2D, we show the interior (2D surface) and in 3D, we show all boundaries
@@ -1013,6 +1278,10 @@ def load_file_su2(su2_file_upload, **kwargs):
                                  )
 
 
+    # boundary conditions from the configuration file that was loaded before the mesh
+    if state.cfg_file_upload is not None:
+        updateBCDictListfromJSON()
+
     # We have loaded a mesh, so enable the exporting of files
     state.export_disabled = False
 
@@ -1035,7 +1304,10 @@ def load_file_su2(su2_file_upload, **kwargs):
     resetCamera()
     
     update_config_str()
-    state.dirty('restartFile')
+    # apply the restart file to the new mesh. A saved case has no restart file,
+    # the restart settings of the case are kept
+    if state.restartFile is not None:
+        state.dirty('restartFile')
 
 
 # load cofiguration .cfg file
@@ -1233,9 +1505,7 @@ with SinglePageWithDrawerLayout(server) as layout:
     layout.title.set_text(" ")
 
     # matplotlib monitor: read the initial history file
-    [state.x,state.ylist] = readHistory(BASE / "user" / state.case_name / state.history_filename)
-    log("info", f"x= = {state.x}")
-    log("info", f"y= = {state.ylist}")
+    readHistory(BASE / "user" / state.case_name / state.history_filename)
 
     with layout.toolbar:
 
@@ -1273,6 +1543,12 @@ with SinglePageWithDrawerLayout(server) as layout:
             style="max-width: 300px;",
             #classes="mr-4",
         )
+        # pin the field, it is then read on every refresh during a run
+        with vuetify.VBtn(icon=True, click="trigger('toggle_restart_pin')",
+                          disabled=("!dataset_arrays[mesh_color_array_idx]",)):
+          vuetify.VIcon("{{ dataset_arrays[mesh_color_array_idx] && restart_pinned_fields.includes("
+                        "dataset_arrays[mesh_color_array_idx].array || dataset_arrays[mesh_color_array_idx].text)"
+                        " ? 'mdi-pin' : 'mdi-pin-outline' }}")
         ######################################################
 
         # file input inside the top toolbar
@@ -1296,6 +1572,17 @@ with SinglePageWithDrawerLayout(server) as layout:
             __properties=["accept"],
         )
 
+        # progress of the mesh that is read in the background
+        with vuetify.VCol(v_show=("mesh_loading",), classes="pa-0 ma-0", style="max-width: 200px;"):
+            vuetify.VProgressLinear(
+                value=("mesh_load_progress", 0),
+                height=6,
+                color="purple",
+            )
+            html.Div("{{ mesh_load_text }}", classes="text-caption")
+        with vuetify.VBtn(icon=True, v_show=("mesh_loading",), click=cancel_mesh_load):
+            vuetify.VIcon("mdi-close-circle-outline")
+
         # input .cfg file
         vuetify.VFileInput(
             # read more than one file
@@ -1502,6 +1789,9 @@ with SinglePageWithDrawerLayout(server) as layout:
                   with trame.SizeObserver("figure_size"):
                     html_figure = tramematplotlib.Figure(style="position: absolute")
                     ctrl.update_figure = html_figure.update            # Third Tab
+                # estimate of the time to reach the convergence criteria
+                with vuetify.VCol(cols="auto", classes="pa-0 ma-0"):
+                  convergence_estimate_card()
             config_tab()            # Fourth Tab
             logs_tab()
 
@@ -1609,6 +1899,8 @@ def main():
     parser.add_argument('--config', type=str, help='Path to the configuration file.')
     parser.add_argument('--restart', type=str, help='Path to the restart file in .csv/.dat format.')
     parser.add_argument('--su2', type=str, help='Path to the SU2_CFD executable. Overrides stored path.')
+    parser.add_argument('--case-cache-size', type=int, default=CASE_CACHE_BUDGET // 1024**2, help='Memory budget in MB for keeping recently opened cases in memory (0 disables it).')
+    parser.add_argument('--snapshot-memory', type=int, default=RESTART_SNAPSHOT_BUDGET // 1024**2, help='Memory budget in MB for the restart snapshots kept during a run.')
     parser.add_argument('--clear-data', action='store_true', help='Clear all application data including saved configurations and cases.')
     parser.add_argument('-v', '--version', action='store_true', help='Print the version of SU2GUI and exit.')
 
@@ -1632,6 +1924,9 @@ def main():
         print("All application data cleared.")
         exit(0)
 
+    set_case_cache_budget(args.case_cache_size * 1024**2)
+    set_restart_snapshot_budget(args.snapshot_memory * 1024**2)
+
     # Check if SU2 is installed and get the path
     su2_path = check_su2(su2_path)
     
@@ -1644,14 +1939,8 @@ def main():
 
     if mesh_path and os.path.exists(mesh_path):
         log("info", f"Using SU2 mesh file {mesh_path}")
-        with open(mesh_path, 'r') as f:
-            content = f.read()
-            state.su2_file_upload = {
-                "name": os.path.basename(mesh_path),
-                "size": os.stat(mesh_path).st_size,
-                "content": content,
-                "type": "text/plain",
-            }
+        # only pass the path, the mesh is read from disk by load_file_su2
+        state.su2_file_upload = su2_mesh_file_info(mesh_path)
         state.dirty('su2_file_upload')
     elif mesh_path:
         log("error", f"The SU2 mesh file {mesh_path} does not exist, and was not loaded.")
@@ -18,8 +18,10 @@ from core.logger import log
 from ui.materials import set_json_materials
 from ui.numerics import set_json_numerics
 from ui.physics import set_json_physics
-from core.su2_io import save_json_cfg_file, save_su2mesh
+from core.su2_io import save_json_cfg_file, save_su2mesh, CASE_VTM_FILENAME
 from core.su2_json import updateBCDictListfromJSON
+from core.su2_mesh import su2_mesh_file_info, MESH_CACHE_DIR
+from core.server_files import server_file_info
 from ui.uicard import server
 from ui.mesh import root, mesh_actor, mesh_mapper
 from ui.vtk_helper import renderer
@@ -230,6 +232,8 @@ def download_case():
                 return
 
             for root, dirs, files in os.walk(case_path):
+                # the mesh cache is rebuilt when the case is loaded
+                dirs[:] = [d for d in dirs if d != MESH_CACHE_DIR]
                 for file in files:
                     file_path = os.path.join(root, file)
                     zip_ref.write(file_path, os.path.relpath(file_path, case_path))
@@ -244,6 +248,7 @@ def download_case():
                 return
 
             for root, dirs, files in os.walk(case_path):
+                dirs[:] = [d for d in dirs if d != MESH_CACHE_DIR]
                 for dir_name in dirs:
                     folder_path = os.path.join(root, dir_name)
                     # Add the directory to the zip file
@@ -319,18 +324,22 @@ def load_case(case_name):
     root, dirs, filenames = os.walk(case_path).__next__()
     del dirs
     
+    # a saved case with the mesh and the solution is read in one go,
+    # unless the mesh or the restart file was changed after it was saved
+    vtm_path = os.path.join(root, CASE_VTM_FILENAME)
+    use_vtm = os.path.isfile(vtm_path) and os.path.getmtime(vtm_path) >= max(
+        (os.path.getmtime(os.path.join(root, f)) for f in filenames if f.endswith((".su2", ".csv", ".dat"))), default=0)
+    if use_vtm:
+        state.su2_file_upload = su2_mesh_file_info(vtm_path)
+        state.dirty('su2_file_upload')
+        state.flush()
+
     # try to load mesh file first
-    for file in filenames:
+    for file in filenames if not use_vtm else []:
         if file.endswith(".su2"):
             mesh_path = os.path.join(root, file)
-            with open(mesh_path, 'r') as f:
-                content = f.read()
-                state.su2_file_upload = {
-                    "name": os.path.basename(mesh_path),
-                    "size" : os.stat(mesh_path).st_size,
-                    "content": content,
-                    "type": "text/plain",
-                }
+            # only pass the path, the mesh is read from disk by load_file_su2
+            state.su2_file_upload = su2_mesh_file_info(mesh_path)
             state.dirty('su2_file_upload')
             state.flush()
             break
@@ -357,6 +366,10 @@ def load_case(case_name):
 
             log("info", f"Config file {state.cfg_file_upload['name']} loaded successfully.")
 
+            # the solution was read with the saved case
+            if use_vtm:
+                break
+
             # load the restart file
             log('info', f"Restart file name = {state.restart_filename}")
             if state.restart_filename == None or state.restart=='':
@@ -385,24 +398,8 @@ def load_case(case_name):
                         log("info", f"Restart file '{restart_path}' not found in the case.")
                         return
 
-            if restart_path.endswith(".dat"):
-                with open(restart_path, 'rb') as f:
-                    content = f.read()
-                    state.restartFile = {
-                        "name": os.path.basename(restart_path),
-                        "size" : os.stat(restart_path).st_size,
-                        "content": content,
-                        "type": "text/plain",
-                    }
-            else:
-                with open(restart_path, 'r') as f:
-                    content = f.read()
-                    state.restartFile = {
-                        "name": os.path.basename(restart_path),
-                        "size" : os.stat(restart_path).st_size,
-                        "content": content,
-                        "type": "text/plain",
-                    }
+            # only pass the id of the file, the restart file is read from disk by uploadRestart
+            state.restartFile = server_file_info(restart_path)
 
             log("info", f"Restart file '{state.restart_filename}' loaded successfully.")
 
@@ -95,6 +95,17 @@ def mesh_card():
                 rows="5",
                 v_model=("meshText", "blablabla"),
         )
+        # large 3D meshes are drawn decimated while the camera moves
+        vuetify.VTextField(
+                label="LOD face threshold",
+                v_model=("lod_face_threshold", 1000000),
+                type="number",
+                outlined=True,
+                dense=True,
+                hide_details=True,
+        )
+        # the mesh with the solution, read in one go when the case is loaded again
+        vuetify.VBtn("Save case as .vtm", click="trigger('save_case_vtm')", disabled=("export_disabled",), classes="mt-2")
 
 ###############################################################
 # PIPELINE SUBCARD : MESH
@@ -3,6 +3,7 @@
 
 import sys
 import os
+import math
 from pathlib import Path
 
 # Add parent directory to path to allow importing from sibling directories
@@ -20,6 +21,7 @@ from vtkmodules.vtkRenderingAnnotation import vtkAxesActor
 from vtkmodules.vtkCommonTransforms import vtkTransform
 from vtkmodules.vtkCommonColor import vtkNamedColors
 from vtkmodules.vtkCommonCore import vtkLookupTable
+from vtkmodules.vtkFiltersCore import vtkQuadricClustering, vtkTriangleFilter
 from vtkmodules.vtkRenderingAnnotation import vtkCubeAxesActor, vtkScalarBarActor
 from vtkmodules.vtkInteractionWidgets import vtkOrientationMarkerWidget, vtkScalarBarWidget
 from vtkmodules.vtkRenderingCore import (
@@ -167,6 +169,15 @@ def get_diverging_lut():
     return lut
 
 
+# color by the magnitude or by a component of a vector array, array is an entry of state.dataset_arrays
+def set_lut_component(lut, array):
+    if array.get("component", -1) < 0:
+        lut.SetVectorModeToMagnitude()
+    else:
+        lut.SetVectorModeToComponent()
+        lut.SetVectorComponent(array.get("component"))
+
+
 def get_diverging_lut1():
     colors = vtkNamedColors()
     # Colour transfer function.
@@ -213,4 +224,19 @@ def MakeScalarBarWidget(scalarbar):
     scalarbarwidget.SetScalarBarActor(scalarbar)
     scalarbarwidget.RepositionableOn()
     scalarbarwidget.On()
-    return scalarbarwidget
\ No newline at end of file
+    return scalarbarwidget
+
+
+# coarse version of a surface with about target_faces triangles, used while the camera is moving
+def MakeDecimatedPolyData(polydata, target_faces):
+    triangles = vtkTriangleFilter()
+    triangles.SetInputData(polydata)
+    # quadric clustering is linear in the number of faces, so it is cheap for very large surfaces.
+    # on a surface, the number of faces grows with the square of the number of divisions
+    decimate = vtkQuadricClustering()
+    decimate.SetInputConnection(triangles.GetOutputPort())
+    divisions = max(4, int(math.sqrt(target_faces / 2)))
+    decimate.SetNumberOfDivisions(divisions, divisions, divisions)
+    decimate.AutoAdjustNumberOfDivisionsOn()
+    decimate.Update()
+    return decimate.GetOutput()